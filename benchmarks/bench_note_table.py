@@ -0,0 +1,61 @@
+"""
+比较 dict 列表与 NoteTable 两种音符表示的内存占用和遍历速度。
+
+用法: python benchmarks/bench_note_table.py [音符数]
+"""
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import malody_beats
+from malody_notes import NoteTable
+from synth import make_notes
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def best_of(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    source = make_notes(count)
+
+    notes, dict_bytes = measure_memory(lambda: copy.deepcopy(source))
+    table, table_bytes = measure_memory(lambda: NoteTable(source))
+    assert table.to_notes() == notes
+
+    def iterate_dicts():
+        return [n['beat'][0] + n['beat'][1] / n['beat'][2] for n in notes]
+
+    def iterate_table():
+        return malody_beats.beat_positions(table.column('measure'), table.column('num'), table.column('den'))
+
+    dict_time = best_of(iterate_dicts)
+    table_time = best_of(iterate_table)
+
+    print(f"notes: {count}")
+    print(f"memory  dict list: {dict_bytes / 1024:.0f} KiB  NoteTable: {table_bytes / 1024:.0f} KiB  "
+          f"({dict_bytes / table_bytes:.1f}x smaller)")
+    print(f"iterate dict list: {dict_time * 1000:.2f} ms  NoteTable: {table_time * 1000:.2f} ms  "
+          f"({dict_time / table_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
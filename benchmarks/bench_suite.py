@@ -0,0 +1,303 @@
+"""
+分度化简工具和曲线编辑器热点路径的无界面基准测试。
+
+在临时目录中生成合成谱面，测量每项操作多次运行的耗时，结果以 JSON 输出；
+指定 --compare 时与之前保存的结果比较，中位数耗时变慢超过阈值的项目记为回归。
+
+用法:
+    python benchmarks/bench_suite.py -o before.json
+    python benchmarks/bench_suite.py --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('MPLBACKEND', 'Agg')  # 编辑器在无界面的 Agg 后端下渲染
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import malody_json
+import synth
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    登记一项基准测试。被登记的函数接收 (args, workdir)，返回 (setup, run, items[, cleanup])：
+    每次计时前调用 setup()（不计时），run() 为被计时的操作，items 为每次处理的条目数，
+    可选的 cleanup() 在该项测试结束后调用。
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def measure(setup, run, repeat):
+    """
+    :return: 每次运行的耗时（秒）
+    """
+    times = []
+    for _ in range(repeat):
+        setup()
+        # 工具会逐个文件打印处理结果，计时时丢弃
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+@benchmark
+def process_mc_file(args, workdir):
+    import malody_catch_colour_changer as changer
+    source = synth.write_mc(os.path.join(workdir, 'source.mc'), args.notes)
+    target = os.path.join(workdir, 'chart.mc')
+    bak_dir = os.path.join(workdir, 'bak')
+    os.makedirs(bak_dir, exist_ok=True)
+    return (lambda: shutil.copyfile(source, target),
+            lambda: changer.process_mc_file(target, bak_dir),
+            args.notes)
+
+
+@benchmark
+def process_mcz_file(args, workdir):
+    import malody_catch_colour_changer as changer
+    source = synth.write_mcz(os.path.join(workdir, 'source.mcz'), args.notes, args.difficulties, args.audio_kb * 1024)
+    target = os.path.join(workdir, 'chart.mcz')
+    bak_dir = os.path.join(workdir, 'mcz-bak')
+    os.makedirs(bak_dir, exist_ok=True)
+    return (lambda: shutil.copyfile(source, target),
+            lambda: changer.process_mcz_file(target, bak_dir),
+            args.notes * args.difficulties)
+
+
+@benchmark
+def normalize_x(args, workdir):
+    editor = load_editor()
+    table = []
+
+    def setup():
+        table[:] = [editor.NoteTable(synth.make_notes(args.notes))]
+
+    return setup, lambda: editor.normalize_x(table[0]), args.notes
+
+
+@benchmark
+def filter_notes(args, workdir):
+    editor = load_editor()
+    index = editor.NoteIndex(editor.NoteTable(synth.make_notes(args.notes)))
+    last_measure = args.notes // 8
+    # 模拟逐帧滚动：每次取一屏（10 拍）范围，与编辑器 update_notes 取的列相同
+    windows = [(y, y + 10) for y in range(0, max(last_measure - 10, 1), max(last_measure // 100, 1))]
+
+    def run():
+        for y_min, y_max in windows:
+            lo, hi = index.window(y_min, y_max)
+            index.positions[lo:hi], index.display_xs(lo, hi), index.ends[lo:hi], index.color_ids[lo:hi]
+
+    return lambda: None, run, len(windows)
+
+
+def control_points(count):
+    return [(float(i * 37 % 512), i * 0.5) for i in range(count)]
+
+
+@benchmark
+def generate_curve(args, workdir):
+    editor = load_editor()
+    points = control_points(args.control_points)
+
+    def setup():
+        # 清空拟合缓存，测量完整拟合的耗时
+        editor.curve_fit_cache.segments.clear()
+        editor._sample_curve.cache_clear()
+
+    return setup, lambda: editor.generate_curve(points, editor.NOTE_DENSITY, 0.5), len(points)
+
+
+@benchmark
+def generate_and_place_notes(args, workdir):
+    editor = load_editor()
+    points = control_points(args.control_points)
+    index = editor.NoteIndex(editor.NoteTable(synth.make_notes(args.notes)))
+
+    def setup():
+        editor.curve_fit_cache.segments.clear()
+
+    return (setup,
+            lambda: editor.generate_and_place_notes(points, editor.DIVIDE, editor.NOTE_DENSITY, 0.5, index),
+            len(points))
+
+
+@benchmark
+def render(args, workdir):
+    editor = load_editor()
+    import matplotlib.pyplot as plt
+    editor.draw_editor(synth.make_notes(args.notes))
+    frame = [0]
+
+    def run():
+        # 向上滚动一拍并重绘，相当于编辑器中按一次方向键
+        frame[0] += 1
+        editor.y_min, editor.y_max = frame[0], frame[0] + editor.y_range_size
+        editor.redraw()
+
+    def cleanup():
+        plt.close('all')
+
+    return lambda: None, run, 1, cleanup
+
+
+def import_module(module):
+    """
+    在新的解释器中导入模块，测量冷启动的导入耗时（包括解释器启动）。
+    """
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-c', f"import {module}"]
+    return lambda: None, lambda: subprocess.run(command, cwd=root, check=True, capture_output=True), 1
+
+
+@benchmark
+def import_editor(args, workdir):
+    return import_module('catch_curve_editor')
+
+
+@benchmark
+def import_editor_core(args, workdir):
+    return import_module('malody_editor_core')
+
+
+_editor = None
+
+
+def load_editor():
+    global _editor
+    if _editor is None:
+        import logging
+        import warnings
+        # 基准测试环境通常没有编辑器配置的中文字体，忽略缺字警告
+        logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+        warnings.filterwarnings('ignore', category=UserWarning)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import catch_curve_editor
+        _editor = catch_curve_editor
+    return _editor
+
+
+def run_benchmarks(args):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='malody-bench-')
+    try:
+        for func in BENCHMARKS:
+            name = func.__name__
+            if args.only and name not in args.only:
+                continue
+            setup, run, items, *cleanup = func(args, workdir)
+            measure(setup, run, 1)  # 预热（导入、缓存等）
+            times = measure(setup, run, args.repeat)
+            for done in cleanup:
+                done()
+            median = statistics.median(times)
+            results[name] = {
+                "median_ms": median * 1000,
+                "min_ms": min(times) * 1000,
+                "max_ms": max(times) * 1000,
+                "items": items,
+                "items_per_sec": items / median if median else None,
+            }
+            print(f"{name:28s} {median * 1000:10.3f} ms  {items / median if median else 0:14.0f} items/s",
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def environment(args):
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy_version,
+        "json_backend": malody_json.BACKEND,
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "params": {"notes": args.notes, "difficulties": args.difficulties, "audio_kb": args.audio_kb,
+                   "control_points": args.control_points, "repeat": args.repeat},
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    比较两次结果的中位数耗时。
+    :return: 回归的项目名列表
+    """
+    regressions = []
+    if baseline.get("environment", {}).get("params") != current["environment"]["params"]:
+        print("warning: baseline was recorded with different parameters", file=sys.stderr)
+    print(f"{'benchmark':28s} {'baseline':>12s} {'current':>12s} {'change':>8s}", file=sys.stderr)
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            print(f"{name:28s} {'-':>12s} {result['median_ms']:10.3f}ms {'new':>8s}", file=sys.stderr)
+            continue
+        ratio = result["median_ms"] / old["median_ms"] if old["median_ms"] else float('inf')
+        result["baseline_median_ms"] = old["median_ms"]
+        result["change"] = ratio - 1
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:28s} {old['median_ms']:10.3f}ms {result['median_ms']:10.3f}ms {ratio - 1:+8.1%}{flag}",
+              file=sys.stderr)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the simplifier and the curve editor.")
+    parser.add_argument('--notes', type=int, default=30000, help="notes per difficulty")
+    parser.add_argument('--difficulties', type=int, default=3, help="difficulties in the generated .mcz")
+    parser.add_argument('--audio-kb', type=int, default=4096, help="size of the generated audio member in KiB")
+    parser.add_argument('--control-points', type=int, default=100, help="control points for the curve benchmarks")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="run only the named benchmarks")
+    parser.add_argument('-o', '--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare against a previous JSON result")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative slowdown counted as a regression in compare mode (default: 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    current = {"environment": environment(args), "results": run_benchmarks(args)}
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'rb') as f:
+            baseline = malody_json.loads(f.read())
+        regressions = compare(baseline, current, args.threshold)
+        current["regressions"] = regressions
+
+    text = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
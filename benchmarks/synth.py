@@ -0,0 +1,68 @@
+"""
+基准测试用的合成谱面生成器：按给定音符数、难度数和音频大小生成 .mc / .mcz。
+
+结果由 seed 决定，同样的参数每次生成的文件内容相同。
+"""
+import os
+import random
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import malody_json
+
+BPM = 180
+
+
+def make_notes(count, seed=0):
+    """
+    生成 count 个音符，大约 5% 为长条；beat 分数未化简，化简工具有实际的工作量。
+    """
+    rng = random.Random(seed)
+    notes = []
+    for i in range(count):
+        den = rng.choice([1, 2, 4, 8, 12, 16])
+        note = {"beat": [i // 8, rng.randrange(den), den], "x": rng.randrange(512)}
+        if rng.random() < 0.05:
+            note["endbeat"] = [i // 8 + 1, 0, 1]
+            note["type"] = 3
+        notes.append(note)
+    return notes
+
+
+def make_chart(count, seed=0, version="Hard"):
+    """
+    生成一个完整的 .mc 谱面数据。
+    """
+    return {
+        "meta": {"creator": "bench", "version": version, "mode": 3,
+                 "song": {"title": "bench", "artist": "bench"}, "mode_ext": {"speed": 12}},
+        "time": [{"beat": [0, 0, 1], "bpm": BPM}],
+        "note": make_notes(count, seed),
+    }
+
+
+def write_mc(path, count, seed=0):
+    """
+    写入一个 .mc 文件。
+    :return: 文件路径
+    """
+    malody_json.dump_file(make_chart(count, seed), path)
+    return path
+
+
+def write_mcz(path, count, difficulties=1, audio_bytes=0, seed=0):
+    """
+    写入一个 .mcz 压缩包：difficulties 个难度（每个 count 个音符），
+    以及一个 audio_bytes 字节的随机内容 .ogg（不可压缩，模拟真实音频）。
+    :return: 文件路径
+    """
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for i in range(difficulties):
+            chart = make_chart(count, seed + i, version=f"Lv.{i + 1}")
+            zout.writestr(f"0/{i + 1}.mc", malody_json.dumps(chart))
+        if audio_bytes:
+            zout.writestr("0/song.ogg", rng.randbytes(audio_bytes))
+    return path
@@ -1,21 +1,44 @@
-import json
-import matplotlib.pyplot as plt
+# matplotlib、pygame（音频播放）和 tkinter（文件对话框）导入较慢，第一次用到时才导入
 import numpy as np
-from scipy.interpolate import make_interp_spline
-from tkinter import filedialog, Tk
-from matplotlib.widgets import Button, Slider
+from functools import lru_cache, partial
+import io
 import zipfile
 import os
-import threading
-import pygame  # 用于音频播放
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import time
+import atexit
+import hashlib
+
+import malody_audio
+import malody_beats
+import malody_journal
+import malody_json
+import malody_profile
+# 计算函数和类都在 malody_editor_core 中，这里一并导入，原来从编辑器模块导入它们的脚本不受影响
+from malody_editor_core import (X_TARGET_RANGE, EditLog, NoteIndex, TimingMap, curve_fit_cache, fit_curve,
+                                generate_and_place_notes, generate_curve, get_note_color_by_divide, merge_spans,
+                                normalize_x, preview_curve, snap_beat, x_transform, _sample_curve)
+from malody_notes import NoteTable
 
 # ----- 配置项 -----
+# 坐标范围、分度吸附、撤销步数等计算相关的配置项在 malody_editor_core 中
 NOTE_DENSITY = 16  # 每段生成多少个 note
 DIVIDE = [1, 4]  # 当前分度，例如 [1,4] 表示 1/4 拍
-X_TARGET_RANGE = 512
 AUX_LINE_COUNT = 20  # 辅助线数量
-ENABLE_SNAP = True  # 时间分度吸附是否开启（始终开启）
+COMPACT_EXPORT = False  # 导出时是否写入不带缩进的最小化 JSON
+PLAYBACK_FPS = 60  # 播放时的目标帧率
+AUDIO_DRIFT_TOLERANCE = 30  # 播放时钟与音频位置相差超过该值（毫秒）时重新对齐
+ARCHIVE_CACHE_BUDGET = 256 * 1024 * 1024  # 已打开谱面压缩包在内存中缓存的成员数据上限（字节）
+LOD_NOTES_PER_PIXEL = 0.5  # 可见音符数超过绘图区每像素高度该值时，改为按密度显示（0 为关闭）
+LOD_BIN_PIXELS = 3  # 密度显示时每个格子大约占多少像素高
+AUTOSAVE = True  # 是否把编辑自动保存到日志，下次打开同一谱面时恢复
+AUTOSAVE_DIR = os.path.join(os.path.expanduser('~'), '.malody_catch_editor', 'autosave')  # 自动保存日志的目录
+NORMALIZE_X_AT_RENDER = False  # 为 True 时导入不改写音符的 x，只在显示时缩放到 [0, X_TARGET_RANGE]
+SHOW_WAVEFORM = True  # 是否在音符后面显示音频波形（按 w 切换）
+SNAP_TO_ONSETS = False  # 控制点是否吸附到检测到的音频起音（按 n 切换）
+ONSET_SNAP_TOLERANCE = 40  # 控制点与起音相差不超过该值（毫秒）时吸附
+ANALYSIS_DIR = os.path.join(os.path.expanduser('~'), '.malody_catch_editor', 'analysis')  # 音频分析结果的缓存目录
 
 control_points = []  # 用户绘制的曲线点
 curve_notes = []
@@ -25,337 +48,667 @@ curve_shape_factor = 0.5  # 曲线形状控制滑条值，范围 [0, 1]
 # 播放状态
 is_playing = False
 current_time = 0  # 当前播放时间（单位：毫秒）
-bpm = 120  # 默认 BPM
+playback_timer = None  # 播放用的 GUI 定时器
+frames_dropped = 0  # 播放时因渲染过慢而跳过的帧数
+current_timing = None  # 当前谱面的 TimingMap
+# 音频和背景图片可以是文件路径，也可以是 (压缩包路径, 成员名) 形式的压缩包成员
 audio_file = None  # 当前音频文件
+background_image = None  # 当前背景图片
 # 全局变量初始化
-current_notes = []  # 当前谱面的音符列表
-loaded_surfaces = []  # 已加载的谱面集合
+current_notes = None  # 当前谱面的音符表（NoteTable）
+current_index = None  # 当前谱面的音符索引（NoteIndex）
+current_history = None  # 当前谱面的编辑记录（EditLog）
+loaded_surfaces = []  # 已加载的谱面集合（Surface），下标即谱面 id，只追加不删除
+current_surface = None  # 当前谱面在 loaded_surfaces 中的 id
+redraw = None  # 编辑器窗口的渲染函数，由 draw_editor 设置
 
 # y 轴缩放参数
 y_min, y_max = 0, 10
 y_range_size = 10  # 初始显示范围大小
 
-# ----- 配置中文字体 -----
-from matplotlib import rcParams
-rcParams['font.sans-serif'] = ['SimHei']  # 设置中文字体为黑体
-rcParams['axes.unicode_minus'] = False   # 显示负号
+def setup_matplotlib():
+    """
+    导入 matplotlib 并配置中文字体（第一次打开编辑器窗口时调用）。
+    """
+    from matplotlib import rcParams
+    rcParams['font.sans-serif'] = ['SimHei']  # 设置中文字体为黑体
+    rcParams['axes.unicode_minus'] = False   # 显示负号
 
 # ----- 工具函数 -----
 def export_file(notes):
     """
     导出当前谱面到 .mc 文件
+    :return: 是否已导出（取消选择时为 False）
     """
+    from tkinter import filedialog, Tk
     root = Tk()
     root.withdraw()
     file_path = filedialog.asksaveasfilename(defaultextension=".mc", filetypes=[("Malody Chart Files", "*.mc")])
     if not file_path:
-        return
+        return False
 
+    if isinstance(notes, NoteTable):
+        notes = notes.to_notes()
     data = {"note": notes}
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    malody_json.dump_file(data, file_path, COMPACT_EXPORT, indent=4)
+    return True
+
+# 已加载的一个谱面（难度），notes 是 NoteTable，index 是预先建好的 NoteIndex，切换时无需重建，
+# history 是该谱面的编辑记录（EditLog），journal 是它的自动保存日志（未启用时为 None）
+Surface = namedtuple('Surface', ['name', 'notes', 'index', 'background_image', 'audio_file', 'timing', 'history',
+                                 'journal'])
+
+def add_surface(surface):
+    """
+    登记谱面，返回它的 id。
+    """
+    loaded_surfaces.append(surface)
+    return len(loaded_surfaces) - 1
 
 def load_new_surface():
     """
-    加载新的谱面
+    加载新的谱面（压缩包中的所有难度），并切换到其中第一个
     """
-    global current_notes, background_image, audio_file, loaded_surfaces
-    notes, bg_image, audio = import_file()
-    if notes:
-        loaded_surfaces.append((notes, bg_image, audio))
-        switch_surface(len(loaded_surfaces) - 1)
+    surfaces = import_file()
+    if surfaces:
+        first_id = len(loaded_surfaces)
+        for surface in surfaces:
+            add_surface(surface)
+        switch_surface(first_id)
+    return bool(surfaces)
 
 def switch_surface(index):
     """
-    切换到指定谱面
-    """
-    global current_notes, background_image, audio_file
-    notes, bg_image, audio = loaded_surfaces[index]
-    current_notes = notes
-    background_image = bg_image
-    audio_file = audio
-    render()
-def gcd(a, b):
-    """
-    计算最大公约数（用于简化分度）。
-    :param a: 第一个整数。
-    :param b: 第二个整数。
-    :return: 最大公约数。
-    """
-    while b:
-        a, b = b, a % b
-    return a
-def get_note_color_by_divide(beat):
-    """
-    根据时间分度获取音符颜色。
-    :param beat: 音符的节拍信息，格式为 [小节数, 分子拍数, 分母拍数]。
-    :return: 对应的颜色。
-    """
-    color_map = {
-        (1, 1): 'red', (1, 2): 'blue', (1, 3): 'green',
-        (1, 4): 'purple', (1, 6): 'green', (1, 8): 'yellow',
-        (1, 12): 'green', (1, 16): 'yellow', (1, 24): 'green',
-        (1, 32): 'yellow'
-    }
-    if beat[2] == 0:
-        return 'gray'
-    div = (1, beat[2] // gcd(beat[1], beat[2])) if beat[1] != 0 else (1, 1)
-    return color_map.get(div, 'gray')
-def normalize_x(notes):
-    """
-    归一化 note 的 x 坐标到指定范围 [0, X_TARGET_RANGE]。
-    :param notes: 包含音符信息的列表，其中每个音符应包含 'x' 属性。
-    :return: 坐标归一化后的音符列表。
-    """
-    xs = [n['x'] for n in notes if 'x' in n]
-    if not xs:
-        return notes
-    min_x, max_x = min(xs), max(xs)
-    scale = X_TARGET_RANGE / (max_x - min_x) if max_x != min_x else 1
-    for n in notes:
-        if 'x' in n:
-            n['x'] = int((n['x'] - min_x) * scale)
-    return notes
-def generate_curve(points, density, shape_factor):
-    """
-    根据关键点生成平滑曲线的点列表。
-
-    :param points: 关键点列表 [(x1, y1), (x2, y2), ...]
-    :param density: 每段生成的点数量
-    :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
-    :return: 曲线点列表 [(x, y), ...]
-    """
-    if len(points) < 2:
-        return []
+    切换到指定 id 的谱面
+    """
+    global current_surface, current_notes, current_index, current_history, background_image, audio_file, current_timing
+    surface = loaded_surfaces[index]
+    current_surface = index
+    current_notes = surface.notes
+    current_index = surface.index
+    current_history = surface.history
+    background_image = surface.background_image
+    audio_file = surface.audio_file
+    current_timing = surface.timing
+    if redraw:
+        redraw()
+class ChartArchive:
+    """
+    已打开的 .mcz 压缩包。中央目录只在打开时读取一次，谱面、音频和图片成员
+    按需从压缩包中读取，不解压到磁盘。读取过的音频/图片成员缓存在内存中。
+    """
 
-    xs, ys = zip(*points)
-    xs = np.array(xs)
-    ys = np.array(ys)
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, 'r')
+        names = [info.filename for info in self.zip.infolist() if not info.is_dir()]
+        self.mc_files = [name for name in names if name.endswith(".mc")]
+        self.image_files = [name for name in names if name.lower().endswith((".jpg", ".png"))]
+        self.audio_files = [name for name in names if name.lower().endswith(".ogg")]
+        self.members = {}  # 成员名 -> 已读取的数据
+        self.size = 0  # 已缓存成员数据的总字节数
+
+    def load_chart(self, name):
+        """
+        在内存中解析指定的 .mc 成员。谱面数据解析后不再需要，不做缓存。
+        """
+        with malody_profile.stage('zip_read'):
+            raw = self.zip.read(name)
+        malody_profile.count('bytes_read', len(raw))
+        with malody_profile.stage('json_parse'):
+            return malody_json.loads(raw)
+
+    def read(self, name):
+        data = self.members.get(name)
+        if data is None:
+            with malody_profile.stage('zip_read'):
+                data = self.members[name] = self.zip.read(name)
+            self.size += len(data)
+            malody_profile.count('bytes_read', len(data))
+        return data
+
+    def close(self):
+        self.zip.close()
+        self.members.clear()
+        self.size = 0
+
+class ArchiveCache:
+    """
+    按最近使用顺序缓存已打开的谱面压缩包，缓存成员数据总量超过 budget 时
+    关闭最久未使用的压缩包（正在使用的压缩包不会被淘汰）。
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.archives = OrderedDict()  # 压缩包绝对路径 -> ChartArchive
 
-    # 调整曲线形状，根据 shape_factor 修改插值点
-    mid_xs = (xs[:-1] + xs[1:]) / 2
-    mid_ys = (ys[:-1] + ys[1:]) / 2
-    adjusted_xs = mid_xs + (xs[1:] - xs[:-1]) * (shape_factor - 0.5)
+    def get(self, path):
+        path = os.path.abspath(path)
+        archive = self.archives.get(path)
+        if archive is None:
+            archive = self.archives[path] = ChartArchive(path)
+        self.archives.move_to_end(path)
+        return archive
 
-    # 插值点组合：起点 -> 调整点 -> 终点
-    interp_xs = np.empty(len(xs) + len(adjusted_xs))
-    interp_xs[0::2] = xs
-    interp_xs[1::2] = adjusted_xs
+    def read(self, path, name):
+        """
+        读取压缩包成员，并按预算淘汰其它压缩包。
+        """
+        archive = self.get(path)
+        data = archive.read(name)
+        self._evict(keep=archive)
+        return data
+
+    def _evict(self, keep):
+        total = sum(archive.size for archive in self.archives.values())
+        for path in list(self.archives):
+            if total <= self.budget:
+                break
+            archive = self.archives[path]
+            if archive is keep:
+                continue
+            total -= archive.size
+            archive.close()
+            del self.archives[path]
+
+archive_cache = ArchiveCache(ARCHIVE_CACHE_BUDGET)
+
+def open_resource(ref):
+    """
+    打开音频/图片资源：文件路径原样返回，压缩包成员返回内存中的文件对象。
+    """
+    if isinstance(ref, tuple):
+        return io.BytesIO(archive_cache.read(*ref))
+    return ref
+
+analysis_executor = None  # 后台分析音频的线程池（第一次用到时创建，整个会话共用）
+audio_analyses = {}  # 音频 -> 分析任务（Future）
+
+def _analyze_audio(ref, data):
+    try:
+        with malody_profile.stage('audio_analysis'):
+            return malody_audio.load_analysis(data, ANALYSIS_DIR)
+    except (OSError, ValueError) as e:
+        print(f"无法分析音频 {ref}: {e}")
+        return None
+
+def start_audio_analysis(ref):
+    """
+    开始在后台线程中分析音频（同一音频只分析一次），返回分析任务的 Future。
+    音频数据在调用线程中读取，压缩包缓存只在界面线程中使用。
+    """
+    global analysis_executor
+    future = audio_analyses.get(ref)
+    if future is not None:
+        return future
+    try:
+        if isinstance(ref, tuple):
+            data = archive_cache.read(*ref)
+        else:
+            with open(ref, 'rb') as f:
+                data = f.read()
+    except (OSError, KeyError) as e:
+        print(f"无法分析音频 {ref}: {e}")
+        future = Future()
+        future.set_result(None)
+    else:
+        if analysis_executor is None:
+            analysis_executor = ThreadPoolExecutor(max_workers=1)
+        future = analysis_executor.submit(_analyze_audio, ref, data)
+    audio_analyses[ref] = future
+    return future
 
-    interp_ys = np.empty(len(ys) + len(mid_ys))
-    interp_ys[0::2] = ys
-    interp_ys[1::2] = mid_ys
+def audio_analysis(ref):
+    """
+    音频的波形包络和起音时间（见 malody_audio），按音频内容缓存在 ANALYSIS_DIR 中，
+    同一首歌只在第一次打开时解码。解码和分析在后台进行，不阻塞界面：
+    还没有分析完时返回 None（第一次调用时开始分析），无法解码时也返回 None。
+    """
+    future = start_audio_analysis(ref)
+    return future.result() if future.done() else None
 
-    # 平滑曲线
-    spline = make_interp_spline(interp_xs, interp_ys)
-    xnew = np.linspace(min(xs), max(xs), density * (len(xs) - 1))
-    ynew = spline(xnew)
+@lru_cache(maxsize=8)
+def load_background(ref):
+    """
+    读取并解码背景图片（结果缓存，切换谱面或重绘时不再重复解码）。
+    """
+    if isinstance(ref, str) and not os.path.exists(ref):
+        return None
+    import matplotlib.pyplot as plt
+    return plt.imread(open_resource(ref))
 
-    return list(zip(xnew, ynew))
+open_journals = []  # 已打开的自动保存日志，退出时写完并关闭
 
-def generate_and_place_notes(points, start_beat, density, shape_factor):
+def journal_path(archive_path, name):
+    """
+    压缩包中某个谱面的自动保存日志路径。
     """
-    根据关键点生成曲线并放置音符。
+    key = hashlib.sha1(f"{os.path.abspath(archive_path)}|{name}".encode('utf-8')).hexdigest()[:16]
+    return os.path.join(AUTOSAVE_DIR, f"{os.path.splitext(os.path.basename(name))[0]}-{key}.journal")
 
-    :param points: 关键点列表 [(x1, y1), (x2, y2), ...]
-    :param start_beat: 起始拍数 [小节数, 分子拍数, 分母拍数]
-    :param density: 每段生成的音符数量
-    :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
-    :return: 生成的音符列表
+def close_journals(discard=False):
     """
-    curve_points = generate_curve(points, density, shape_factor)
-    if not curve_points:
-        return []
+    写完并关闭所有自动保存日志。
+    :param discard: 为 True 时同时删除日志（正常退出时，未导出的编辑不再恢复）
+    """
+    while open_journals:
+        open_journals.pop().close(discard)
 
-    notes = []
-    for i, (x, y) in enumerate(curve_points):
-        beat_index = start_beat[0] * start_beat[2] + start_beat[1] + i * (start_beat[2] // (density * len(points)))
-        beat = [beat_index // start_beat[2], beat_index % start_beat[2], start_beat[2]]
-        notes.append({"beat": beat, "x": int(x)})
+atexit.register(close_journals)
 
-    return notes
+def load_chart(archive, name):
+    """
+    解析压缩包中的一个 .mc 谱面，构建音符索引和变速信息。
+    存在与该谱面匹配的自动保存日志时先重放日志，恢复上次的编辑。
+    :return: Surface
+    """
+    data = archive.load_chart(name)
+    notes = NoteTable(data.get('note', []))
+    bounds = notes.x_bounds()
+    transform = x_transform(*bounds) if NORMALIZE_X_AT_RENDER and bounds is not None else (0, 1)
+    if transform == (0, 1):
+        normalize_x(notes)
+
+    journal = None
+    if AUTOSAVE:
+        # 原谱面以压缩包成员的 CRC 和大小标识，谱面被替换后旧日志不再重放
+        info = archive.zip.getinfo(name)
+        base = {'source': [os.path.abspath(archive.path), name], 'member': f"{info.CRC:08x}-{info.file_size}",
+                'normalized': transform == (0, 1)}
+        path = journal_path(archive.path, name)
+        recovered = 0
+        if malody_journal.read_base(path) == dict(base, op='base'):
+            notes, recovered = malody_journal.replay(path, notes)
+            if recovered:
+                print(f"已从自动保存恢复 {recovered} 条编辑：{name}")
+        os.makedirs(AUTOSAVE_DIR, exist_ok=True)
+        journal = malody_journal.Journal(path, base, notes, snapshot=bool(recovered))
+        open_journals.append(journal)
+
+    index = NoteIndex(notes, transform)
+    history = EditLog(index)
+    if journal is not None:
+        history.listeners.append(journal.record)
+    version = data.get('meta', {}).get('version') or os.path.basename(name)
+    background_image = (archive.path, archive.image_files[0]) if archive.image_files else None
+    audio_file = (archive.path, archive.audio_files[0]) if archive.audio_files else None
+    return Surface(version, notes, index, background_image, audio_file, TimingMap.from_chart(data), history, journal)
 
 def import_file():
     """
-    导入 MCZ 文件，并加载 note 数据、背景图像和音频。
+    导入 MCZ 文件，并加载其中所有难度的 note 数据、背景图像和音频。
+    :return: Surface 列表，取消选择时为空列表
     """
+    from tkinter import filedialog, Tk
     root = Tk()
     root.withdraw()
     file_path = filedialog.askopenfilename(filetypes=[("Malody Archive Files", "*.mcz")])
     if not file_path:
-        return [], None, None
+        return []
 
     if file_path.endswith('.mcz'):
-        # 解压 MCZ 文件
-        with zipfile.ZipFile(file_path, 'r') as z:
-            temp_dir = file_path + "_temp"
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)  # 创建临时目录
-            z.extractall(temp_dir)
-
-            # 查找 .mc 文件
-            mc_files = [os.path.join(root, file) for root, _, files in os.walk(temp_dir) for file in files if file.endswith(".mc")]
-            if not mc_files:
-                raise FileNotFoundError(f"No MC file found in extracted MCZ directory: {temp_dir}")
-
-            # 读取找到的第一个 .mc 文件
-            mc_path = mc_files[0]
-            with open(mc_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 获取音符数据
-            notes = data.get('note', [])
-            notes = normalize_x(notes)
-
-            # 查找背景图片
-            image_files = [os.path.join(root, file) for root, _, files in os.walk(temp_dir) for file in files if file.endswith((".jpg", ".png"))]
-            background_image = image_files[0] if image_files else None
-
-            # 查找音频文件
-            audio_files = [os.path.join(root, file) for root, _, files in os.walk(temp_dir) for file in files if file.endswith(".ogg")]
-            audio_file = audio_files[0] if audio_files else None
-
-            return notes, background_image, audio_file
+        # 只读取压缩包目录，谱面在内存中解析，音频和背景图片用到时再从压缩包读取
+        archive = archive_cache.get(file_path)
+        if not archive.mc_files:
+            raise FileNotFoundError(f"No MC file found in MCZ archive: {file_path}")
+
+        # 音频在后台线程中分析，不等待分析完成；分析完成后编辑器自动重绘以显示波形
+        if archive.audio_files and (SHOW_WAVEFORM or SNAP_TO_ONSETS):
+            start_audio_analysis((archive.path, archive.audio_files[0]))
+        # 并行解析所有难度（成员解压时 zlib 会释放 GIL）
+        workers = min(len(archive.mc_files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(partial(load_chart, archive), archive.mc_files))
     else:
         raise ValueError("The selected file is not a valid MCZ file.")
 
-def play(render_function):
-    """
-    播放功能，根据 BPM 流速滚动时间范围，同时播放音频。
+def play(render_function, canvas):
     """
-    global is_playing, current_time, y_min, y_max, audio_file
+    播放功能，按谱面的变速信息滚动时间范围，同时播放音频。
 
-    def update():
-        global current_time, y_min, y_max
-        start_time = time.time()  # 记录起始时间
-
-        # 初始化音频播放
-        if audio_file:
+    时间取自单调时钟，并与 pygame 的音频播放位置对齐；重绘由 GUI 定时器按
+    PLAYBACK_FPS 驱动，渲染跟不上时直接跳到当前时间（丢帧），不会积压。
+    """
+    global current_time, playback_timer, frames_dropped
+    import pygame
+    timing = current_timing or TimingMap([])
+    current_time = timing.beat_to_ms(y_min)
+    start_time = current_time  # 本次播放开始时的谱面时间（毫秒）
+    anchor = time.perf_counter()  # 与 start_time 对应的时钟读数
+    frame_interval = 1000 / PLAYBACK_FPS
+    last_tick = anchor
+    audio_start = max(current_time, 0)  # 音频开始播放的位置（毫秒），get_pos() 从这里开始计时
+
+    # 初始化音频播放
+    if audio_file:
+        if not pygame.mixer.get_init():
             pygame.mixer.init()
-            pygame.mixer.music.load(audio_file)
-            pygame.mixer.music.play(start=(current_time / 1000.0))  # 从当前时间点播放
+        pygame.mixer.music.load(open_resource(audio_file), namehint='ogg')
+        pygame.mixer.music.play(start=audio_start / 1000.0)  # 从当前时间点播放
 
-        while is_playing:
-            elapsed_time = (time.time() - start_time) * 1000  # 计算已过去的时间（毫秒）
-            current_time += elapsed_time
-            start_time = time.time()  # 重置起始时间
-
-            # 更新显示范围
-            beat_duration = 60000 / bpm  # 每拍时长（毫秒）
-            y_min += elapsed_time / beat_duration
-            y_max = y_min + y_range_size
-            render_function()
-
-            time.sleep(0.01)  # 减少 CPU 占用
+    def tick():
+        global current_time, y_min, y_max, frames_dropped
+        nonlocal anchor, start_time, last_tick
+        if not is_playing:
+            return
+        now = time.perf_counter()
+        dropped = max(0, int((now - last_tick) * 1000 / frame_interval) - 1)
+        frames_dropped += dropped
+        malody_profile.count('frames_dropped', dropped)
+        last_tick = now
+        current_time = start_time + (now - anchor) * 1000
+
+        # 与音频位置对齐：get_pos 精度较粗，只在偏差超过容差时重新锚定时钟
+        if audio_file and pygame.mixer.music.get_busy():
+            audio_time = audio_start + pygame.mixer.music.get_pos()
+            if abs(audio_time - current_time) > AUDIO_DRIFT_TOLERANCE:
+                start_time, anchor = audio_time, now
+                current_time = audio_time
+
+        # 更新显示范围
+        y_min = timing.ms_to_beat(current_time)
+        y_max = y_min + y_range_size
+        render_function()
 
-        # 停止音频播放
-        if audio_file:
-            pygame.mixer.music.stop()
+    playback_timer = canvas.new_timer(interval=int(frame_interval))
+    playback_timer.add_callback(tick)
+    playback_timer.start()
 
-    thread = threading.Thread(target=update)
-    thread.start()
+def stop():
+    """
+    停止播放和音频。
+    """
+    global playback_timer
+    if playback_timer is not None:
+        playback_timer.stop()
+        playback_timer = None
+    import pygame
+    if audio_file and pygame.mixer.get_init():
+        pygame.mixer.music.stop()
 
 def on_switch(event):
     """
     切换按钮触发函数，切换到下一个谱面
     """
-    global current_notes, background_image, audio_file, loaded_surfaces
     if loaded_surfaces:
-        current_index = loaded_surfaces.index((current_notes, background_image, audio_file))
-        next_index = (current_index + 1) % len(loaded_surfaces)
-        switch_surface(next_index)
+        switch_surface((current_surface + 1) % len(loaded_surfaces))
 
-def toggle_play(render_function):
+def toggle_play(render_function, canvas):
     """
     切换播放/暂停状态。
     """
     global is_playing
     is_playing = not is_playing
     if is_playing:
-        play(render_function)
+        play(render_function, canvas)
+    else:
+        stop()
+        render_function()
 
-def draw_editor(notes, background_image, audio_file_path):
-    global y_min, y_max, y_range_size, AUX_LINE_COUNT, curve_notes, curve_gen_enabled, control_points, curve_shape_factor, audio_file
-    audio_file = audio_file_path  # 记录音频文件路径
+def draw_editor(notes=None, background_image_path=None, audio_file_path=None, timing=None):
+    """
+    打开编辑器窗口。传入 notes 时将其登记为新谱面并切换过去，否则编辑当前谱面。
+    """
+    global y_min, y_max, y_range_size, AUX_LINE_COUNT, curve_notes, curve_gen_enabled, control_points, curve_shape_factor
+    global redraw
+    if notes is not None:
+        if not isinstance(notes, NoteTable):
+            notes = NoteTable(notes)
+        index = NoteIndex(notes)
+        switch_surface(add_surface(Surface("", notes, index, background_image_path, audio_file_path, timing, EditLog(index), None)))
+
+    setup_matplotlib()
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.widgets import Button, Slider
 
     fig, ax = plt.subplots()
-    plt.subplots_adjust(bottom=0.35)  # 为按钮和两个滑条腾出空间
+    plt.subplots_adjust(bottom=0.4)  # 为按钮和滑条腾出更多空间
 
     # 初始化显示范围
     ax.set_xlim(0, X_TARGET_RANGE)
     ax.set_ylim(y_min, y_max)
+    ax.set_title("Malody Catch 曲线编辑器")
+    shown_surface = None  # 标题中当前显示的谱面 id
+    ax.set_xlabel("X [0-512]")
+    ax.set_ylabel("时间 (拍数)")
+    ax.grid(True)
+
+    # --- 常驻图元：每帧只更新数据和显示范围，不再清空重建 ---
+    background_artist = None  # 背景图片
+    background_path = None  # 背景图片当前显示的文件
+    # 时间分度辅助线画在坐标轴坐标系里，随显示范围自动平移，只在数量变化时更新
+    aux_lines = LineCollection([], colors='gray', linestyles='--', alpha=0.3, transform=ax.transAxes)
+    ax.add_collection(aux_lines)
+    hold_patches = PolyCollection([], facecolors='blue', edgecolors='none', alpha=0.3)
+    ax.add_collection(hold_patches)
+    # 音频波形：以 x 轴中线为中心左右对称的一个多边形，画在音符后面
+    waveform = PolyCollection([], facecolors='gray', edgecolors='none', alpha=0.35, zorder=0.5)
+    ax.add_collection(waveform)
+    # 每种颜色一个散点集合
+    note_scatters = [ax.scatter([], [], s=100, color=color, zorder=3) for color in malody_beats.COLOR_CLASSES]
+    # 缩小显示时代替散点的密度图
+    density_image = ax.imshow(np.zeros((1, 1)), extent=[0, X_TARGET_RANGE, 0, 1], origin='lower', aspect='auto',
+                              cmap='plasma', interpolation='nearest', alpha=0.8, zorder=3, visible=False)
+    ax.set_xlim(0, X_TARGET_RANGE)
+    control_line, = ax.plot([], [], 'ro', label="控制点", markersize=10, zorder=4)
+    preview_line, = ax.plot([], [], 'r-', alpha=0.6, zorder=4)  # 曲线预览
+    curve_scatter = ax.scatter([], [], s=64, marker='s', color='green', zorder=4)
+    dynamic_artists = [waveform, hold_patches, *note_scatters, density_image, preview_line, control_line, curve_scatter]
+    dragging = None  # 正在拖动的控制点下标
+
+    # 播放时使用 blit：背景（不含动态图元和 y 轴）只在完整重绘时缓存一次
+    blit_background = None
+
+    def on_draw(event):
+        nonlocal blit_background
+        if is_playing and fig.canvas.supports_blit:
+            blit_background = fig.canvas.copy_from_bbox(fig.bbox)
+
+    def set_blit(enabled):
+        nonlocal blit_background
+        for artist in dynamic_artists + [ax.yaxis]:
+            artist.set_animated(enabled)
+        blit_background = None
+        fig.canvas.draw()  # 触发 on_draw 缓存背景
+
+    def update_aux_lines():
+        ys = [i / AUX_LINE_COUNT for i in range(AUX_LINE_COUNT + 1)]
+        aux_lines.set_segments([[(0, y), (1, y)] for y in ys])
+
+    def update_background():
+        nonlocal background_artist, background_path, shown_surface
+        if current_surface != shown_surface:
+            shown_surface = current_surface
+            name = loaded_surfaces[current_surface].name
+            ax.set_title(f"Malody Catch 曲线编辑器 - {name}" if name else "Malody Catch 曲线编辑器")
+        if background_image == background_path:
+            return
+        background_path = background_image
+        img = load_background(background_image) if background_image else None
+        if img is None:
+            if background_artist is not None:
+                background_artist.set_visible(False)
+            return
+        if background_artist is None:
+            background_artist = ax.imshow(img, extent=[0, X_TARGET_RANGE, y_min, y_max], aspect='auto', alpha=0.5, zorder=0)
+            ax.set_xlim(0, X_TARGET_RANGE)
+        else:
+            background_artist.set_data(img)
+        background_artist.set_visible(True)
+
+    # 音频还在后台分析时定时检查，分析完成后重绘一次以显示波形
+    analysis_timer = fig.canvas.new_timer(interval=200)
+
+    def on_analysis_timer():
+        if audio_file and not start_audio_analysis(audio_file).done():
+            return
+        analysis_timer.stop()
+        if not is_playing:  # 播放时每帧都会重绘
+            render()
 
-    def filter_notes(notes, y_min, y_max):
-        """仅渲染当前范围内的 note"""
-        return [note for note in notes if 'beat' in note and y_min <= (note['beat'][0] + note['beat'][1] / note['beat'][2]) <= y_max]
+    analysis_timer.add_callback(on_analysis_timer)
 
-    def render():
-        """根据当前范围渲染图像"""
-        ax.clear()
-
-        # 恢复之前的显示范围
-        ax.set_xlim(0, X_TARGET_RANGE)
-        ax.set_ylim(y_min, y_max)
-
-        # 绘制背景
-        if background_image and os.path.exists(background_image):
-            img = plt.imread(background_image)
-            ax.imshow(img, extent=[0, X_TARGET_RANGE, y_min, y_max], aspect='auto', alpha=0.5)
-
-        # 绘制时间分度辅助线
-        for i in range(AUX_LINE_COUNT + 1):
-            time_y = y_min + i * (y_max - y_min) / AUX_LINE_COUNT
-            ax.axhline(time_y, color='gray', linestyle='--', alpha=0.3)
-
-        # 绘制音符
-        visible_notes = filter_notes(notes, y_min, y_max)
-        for note in visible_notes:
-            if 'endbeat' in note:
-                start_y = note['beat'][0] + note['beat'][1] / note['beat'][2]
-                end_y = note['endbeat'][0] + note['endbeat'][1] / note['beat'][2]
-                ax.add_patch(plt.Rectangle((0, start_y), X_TARGET_RANGE, end_y - start_y, color='blue', alpha=0.3))
-            elif 'x' in note:
-                color = get_note_color_by_divide(note['beat'])
-                time_y = note['beat'][0] + note['beat'][1] / note['beat'][2]
-                ax.plot(note['x'], time_y, 'o', color=color, markersize=10)
-
-        # 绘制用户控制点
+    def update_waveform():
+        analysis = audio_analysis(audio_file) if SHOW_WAVEFORM and audio_file else None
+        if analysis is None:
+            waveform.set_visible(False)
+            if SHOW_WAVEFORM and audio_file and not start_audio_analysis(audio_file).done():
+                analysis_timer.start()
+            return
+        timing = current_timing or TimingMap([])
+        # 每像素高度最多一个点
+        times, peaks = analysis.envelope_between(timing.beat_to_ms(y_min), timing.beat_to_ms(y_max),
+                                                 int(ax.bbox.height))
+        beats = timing.ms_to_beat(times)
+        center, half_width = X_TARGET_RANGE / 2, X_TARGET_RANGE / 2
+        outline = np.concatenate((np.column_stack((center - peaks * half_width, beats)),
+                                  np.column_stack((center + peaks * half_width, beats))[::-1]))
+        waveform.set_verts([outline] if len(outline) else [])
+        waveform.set_visible(True)
+
+    def update_notes():
+        with malody_profile.stage('filter'):
+            lo, hi = current_index.window(y_min, y_max)
+        ys = current_index.positions[lo:hi]
+        xs = current_index.display_xs(lo, hi)
+        ends = current_index.ends[lo:hi]
+        color_ids = current_index.color_ids[lo:hi]
+
+        # 长条画成横跨整个宽度的矩形，其余带 x 的音符按颜色分组更新散点
+        holds = ~np.isnan(ends)
+        hold_starts, hold_ends = ys[holds], ends[holds]
+        taps = ~holds & ~np.isnan(xs)
+        pixels = ax.bbox.height
+        lod = LOD_NOTES_PER_PIXEL and hi - lo > LOD_NOTES_PER_PIXEL * pixels
+        if lod:
+            # 长条合并为互不重叠的区间，间隔小于一个像素的也合并
+            hold_starts, hold_ends = merge_spans(hold_starts, hold_ends, (y_max - y_min) / pixels)
+        hold_patches.set_verts([[(0, y0), (X_TARGET_RANGE, y0), (X_TARGET_RANGE, y1), (0, y1)]
+                                for y0, y1 in zip(hold_starts, hold_ends)])
+        if lod:
+            # 音符过密：按密度金字塔中对应分辨率的格子显示，绘制量与音符数无关
+            with malody_profile.stage('lod'):
+                grid, y_start, y_end = current_index.density(y_min, y_max, int(pixels / LOD_BIN_PIXELS))
+            for scatter in note_scatters:
+                scatter.set_offsets(np.empty((0, 2)))
+            if len(grid):
+                density = np.log1p(grid)
+                density_image.set_data(np.ma.masked_equal(density, 0))
+                density_image.set_clim(0, max(density.max(), 1))
+                density_image.set_extent([0, X_TARGET_RANGE, y_start, y_end])
+            density_image.set_visible(bool(len(grid)))
+        else:
+            density_image.set_visible(False)
+            for color_id, scatter in enumerate(note_scatters):
+                mask = taps & (color_ids == color_id)
+                scatter.set_offsets(np.column_stack((xs[mask], ys[mask])))
+
+        # 用户控制点和曲线预览
         if control_points:
             x_cp, y_cp = zip(*control_points)
-            ax.plot(x_cp, y_cp, 'ro-', label="控制点", markersize=10)
+            control_line.set_data(x_cp, y_cp)
+        else:
+            control_line.set_data([], [])
+        preview_line.set_data(*preview_curve(control_points, NOTE_DENSITY, curve_shape_factor))
 
-        # 绘制生成的曲线 note
-        if curve_gen_enabled:
-            for note in curve_notes:
-                time_y = note['beat'][0] + note['beat'][1] / note['beat'][2]
-                ax.plot(note['x'], time_y, 's', color='green', markersize=8)
+        # 生成的曲线 note
+        if curve_gen_enabled and curve_notes:
+            curve_scatter.set_offsets([(note['x'], note['beat'][0] + note['beat'][1] / note['beat'][2]) for note in curve_notes])
+        else:
+            curve_scatter.set_offsets(np.empty((0, 2)))
 
-        ax.set_title("Malody Catch 曲线编辑器")
-        ax.set_xlabel("X [0-512]")
-        ax.set_ylabel("时间 (拍数)")
-        ax.grid(True)
-        fig.canvas.draw_idle()
+    def render():
+        """根据当前范围更新图元并重绘"""
+        nonlocal blit_background
+        with malody_profile.stage('render'):
+            update_background()
+            if background_artist is not None:
+                background_artist.set_extent([0, X_TARGET_RANGE, y_min, y_max])
+            ax.set_ylim(y_min, y_max)
+            update_waveform()
+            update_notes()
+
+            if is_playing and fig.canvas.supports_blit:
+                if blit_background is None:
+                    set_blit(True)
+                # 恢复缓存的背景，只重画动态图元和 y 轴
+                fig.canvas.restore_region(blit_background)
+                for artist in dynamic_artists:
+                    ax.draw_artist(artist)
+                fig.draw_artist(ax.yaxis)
+                fig.canvas.blit(fig.bbox)
+            else:
+                if blit_background is not None or ax.yaxis.get_animated():
+                    set_blit(False)
+                fig.canvas.draw_idle()
+        malody_profile.count('frames_rendered')
+
+    update_aux_lines()
+    fig.canvas.mpl_connect('draw_event', on_draw)
+
+    redraw = render  # 供切换谱面等模块级函数刷新画面
 
     # --- 鼠标事件 ---
+    def snapped_point(event):
+        time_y = event.ydata
+        analysis = audio_analysis(audio_file) if SNAP_TO_ONSETS and audio_file else None
+        if analysis is not None:
+            # 附近有起音时吸附到起音，放置音符时再按分度取整
+            timing = current_timing or TimingMap([])
+            onset = analysis.nearest_onset(timing.beat_to_ms(time_y), ONSET_SNAP_TOLERANCE)
+            if onset is not None:
+                return event.xdata, float(timing.ms_to_beat(onset))
+        snapped_beat = snap_beat([int(time_y), int((time_y % 1) * DIVIDE[1]), DIVIDE[1]], DIVIDE)
+        return event.xdata, snapped_beat[0] + snapped_beat[1] / snapped_beat[2]
+
+    def hit_control_point(event, radius=10):
+        """返回鼠标附近（像素距离 radius 内）的控制点下标"""
+        if not control_points:
+            return None
+        pixels = ax.transData.transform(control_points)
+        distances = np.hypot(pixels[:, 0] - event.x, pixels[:, 1] - event.y)
+        nearest = int(np.argmin(distances))
+        return nearest if distances[nearest] <= radius else None
+
     def on_press(event):
+        nonlocal dragging
         if event.inaxes != ax:
             return
-        if event.button == 1:  # 左键
-            time_y = event.ydata
-            snapped_beat = snap_beat([int(time_y), int((time_y % 1) * DIVIDE[1]), DIVIDE[1]], DIVIDE)
-            control_points.append((event.xdata, snapped_beat[0] + snapped_beat[1] / snapped_beat[2]))
-            render()
+        if event.button == 1:  # 左键：按住已有控制点时拖动，否则添加
+            dragging = hit_control_point(event)
+            if dragging is None:
+                control_points.append(snapped_point(event))
+                render()
+        elif event.button == 3 and event.key == 'shift':  # Shift+右键删除附近的音符
+            row = current_index.nearest(event.xdata, event.ydata, y_min, y_max,
+                                        X_TARGET_RANGE / 50, (y_max - y_min) / 50)
+            if row is not None:
+                current_history.delete([row])
+                render()
         elif event.button == 3 and control_points:  # 右键删除最近点
             control_points.pop()
             render()
 
+    def on_motion(event):
+        if dragging is None or event.inaxes != ax:
+            return
+        point = snapped_point(event)
+        if point != control_points[dragging]:
+            control_points[dragging] = point
+            render()
+
+    def on_release(event):
+        nonlocal dragging
+        dragging = None
+
     # --- 键盘事件 ---
     def on_key(event):
-        global y_min, y_max, curve_notes
+        global y_min, y_max, curve_notes, SHOW_WAVEFORM, SNAP_TO_ONSETS
         if event.key == 'enter':  # 按回车放置音符
             if len(control_points) >= 2:
-                curve_notes = generate_and_place_notes(control_points, [int(y_min), 0, DIVIDE[1]], NOTE_DENSITY, curve_shape_factor)
-                notes.extend(curve_notes)
+                curve_notes = generate_and_place_notes(control_points, DIVIDE, NOTE_DENSITY, curve_shape_factor, current_index)
+                current_history.insert(curve_notes, display=True)
                 control_points.clear()
                 render()
         elif event.key == 'up':  # 向上平移
@@ -367,19 +720,32 @@ def draw_editor(notes, background_image, audio_file_path):
             y_max = max(y_range_size, y_max - 1)
             render()
         elif event.key == ' ':  # 播放/暂停
-            toggle_play(render)
+            toggle_play(render, fig.canvas)
+        elif event.key == 'w':  # 显示/隐藏波形
+            SHOW_WAVEFORM = not SHOW_WAVEFORM
+            render()
+        elif event.key == 'n':  # 开关起音吸附
+            SNAP_TO_ONSETS = not SNAP_TO_ONSETS
+            print(f"起音吸附：{'开' if SNAP_TO_ONSETS else '关'}")
+        elif event.key in ('ctrl+z', 'ctrl+y', 'ctrl+Z', 'ctrl+shift+z'):  # 撤销/重做
+            if current_history.undo() if event.key == 'ctrl+z' else current_history.redo():
+                curve_notes = []
+                render()
 
     # --- 滑条事件 ---
     def update_y_divide(val):
         """更新辅助线数量"""
         global AUX_LINE_COUNT
         AUX_LINE_COUNT = int(val)
+        update_aux_lines()
         render()
 
     def update_curve_shape(val):
         """更新曲线形状控制滑条"""
         global curve_shape_factor
         curve_shape_factor = val
+        render()
+
     def update_slider(val):
         global y_range_size, y_min, y_max
         y_range_size = slider_range.val
@@ -403,40 +769,15 @@ def draw_editor(notes, background_image, audio_file_path):
         """
         导出按钮触发函数，保存当前谱面
         """
-        export_file(current_notes)
-# 导出谱面
-def on_export(event):
-    global current_notes
-    export_file(current_notes)
-
-    def on_switch(event):
-        """
-        切换按钮触发函数，切换到下一个谱面
-        """
-        if loaded_surfaces:
-            current_index = loaded_surfaces.index((current_notes, background_image, audio_file))
-            next_index = (current_index + 1) % len(loaded_surfaces)
-            switch_surface(next_index)
-
-    # 添加按钮控件
-    ax_import = plt.axes([0.1, 0.02, 0.2, 0.05])
-    btn_import = Button(ax_import, "导入谱面")
-    btn_import.on_clicked(on_import)
-
-def draw_editor(notes, background_image, audio_file_path):
-    global y_min, y_max, y_range_size, AUX_LINE_COUNT, curve_notes, curve_gen_enabled, control_points, curve_shape_factor, audio_file
-    audio_file = audio_file_path  # 记录音频文件路径
+        journal = loaded_surfaces[current_surface].journal
+        if export_file(current_notes) and journal is not None:
+            journal.discard()  # 编辑已保存到导出的文件，下次打开时不再重放
 
-    fig, ax = plt.subplots()
-    plt.subplots_adjust(bottom=0.4)  # 为按钮和滑条腾出更多空间
     # 添加按钮
     ax_import = plt.axes([0.1, 0.02, 0.2, 0.05])
     btn_import = Button(ax_import, "导入谱面")
-    btn_import.on_clicked(load_new_surface)
+    btn_import.on_clicked(on_import)
 
-    ax_export = plt.axes([0.4, 0.02, 0.2, 0.05])
-    btn_export = Button(ax_export, "导出谱面")
-    btn_export.on_clicked(on_export)
     ax_export = plt.axes([0.4, 0.02, 0.2, 0.05])
     btn_export = Button(ax_export, "导出谱面")
     btn_export.on_clicked(on_export)
@@ -444,7 +785,8 @@ def draw_editor(notes, background_image, audio_file_path):
     ax_switch = plt.axes([0.7, 0.02, 0.2, 0.05])
     btn_switch = Button(ax_switch, "切换谱面")
     btn_switch.on_clicked(on_switch)
-    ax_button = plt.axes([0.7, 0.02, 0.25, 0.05])  # 曲线显示开关按钮
+
+    ax_button = plt.axes([0.8, 0.09, 0.18, 0.05])  # 曲线显示开关按钮
     btn = Button(ax_button, '切换曲线显示')
     btn.on_clicked(toggle_curve)
 
@@ -460,17 +802,18 @@ def draw_editor(notes, background_image, audio_file_path):
     slider_range = Slider(ax_slider_range, 'Y范围大小', 1, 50, valinit=y_range_size)
     slider_range.on_changed(update_slider)
 
-# --- 事件绑定 ---
-fig.canvas.mpl_connect('button_press_event', on_press)
-fig.canvas.mpl_connect('key_press_event', on_key)
+    # --- 事件绑定 ---
+    fig.canvas.mpl_connect('button_press_event', on_press)
+    fig.canvas.mpl_connect('motion_notify_event', on_motion)
+    fig.canvas.mpl_connect('button_release_event', on_release)
+    fig.canvas.mpl_connect('key_press_event', on_key)
 
-render()  # 初次渲染
-plt.show()
+    render()  # 初次渲染
+    plt.show()
 
 # ----- 主函数入口 -----
 if __name__ == '__main__':
-    notes, background_image, audio_file = import_file()
-    draw_editor(notes, background_image, audio_file)
-ax_switch = plt.axes([0.7, 0.02, 0.2, 0.05])
-btn_switch = Button(ax_switch, "切换谱面")
-btn_switch.on_clicked(lambda event: switch_surface((loaded_surfaces.index((current_notes, background_image, audio_file)) + 1) % len(loaded_surfaces)))
\ No newline at end of file
+    malody_profile.start_from_env()  # 设置环境变量 MALODY_PROFILE 时统计各阶段耗时
+    if load_new_surface():
+        draw_editor()
+        close_journals(discard=True)  # 窗口正常关闭；崩溃时日志保留，下次打开时恢复
@@ -0,0 +1,148 @@
+"""
+音频的离线分析：波形包络和起音（onset）时间。
+
+音频只在第一次分析时解码（使用编辑器已有的 pygame），结果以音频内容的 SHA-1
+为键保存到缓存目录中的 .npz 文件，之后的会话直接读取，不再解码。
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+import numpy as np
+
+ANALYSIS_VERSION = 1  # 分析算法改变时递增，旧的缓存随之失效
+ENVELOPE_MS = 10  # 波形包络每个点覆盖的毫秒数
+ONSET_FRAME = 1024  # 起音检测的 FFT 窗口长度（采样点）
+ONSET_HOP = 512  # 起音检测的帧移（采样点）
+ONSET_MIN_GAP_MS = 50  # 相邻起音的最小间隔
+ONSET_DELTA = 0.1  # 起音的频谱通量需超过局部均值的量（通量已归一化到 0~1）
+
+
+class AudioAnalysis:
+    """
+    分析结果。envelope 为每 envelope_ms 毫秒的峰值（0~1），onsets 为起音时间（毫秒，升序）。
+    """
+
+    def __init__(self, audio_hash, envelope, envelope_ms, onsets):
+        self.audio_hash = audio_hash
+        self.envelope = envelope
+        self.envelope_ms = envelope_ms
+        self.onsets = onsets
+
+    def envelope_between(self, start_ms, end_ms, max_points=None):
+        """
+        返回 [start_ms, end_ms] 内的包络 (时间数组, 峰值数组)，点数超过 max_points 时按峰值合并。
+        """
+        lo = max(int(start_ms // self.envelope_ms), 0)
+        hi = min(int(end_ms // self.envelope_ms) + 1, len(self.envelope))
+        if lo >= hi:
+            return np.empty(0), np.empty(0)
+        values = self.envelope[lo:hi]
+        step = 1
+        if max_points and len(values) > max_points:
+            step = -(-len(values) // max_points)
+            pad = -len(values) % step
+            values = np.pad(values, (0, pad)).reshape(-1, step).max(axis=1)
+        times = (lo + np.arange(len(values)) * step) * self.envelope_ms
+        return times, values
+
+    def nearest_onset(self, ms, tolerance):
+        """
+        :return: 离 ms 最近且相差不超过 tolerance 的起音时间，没有时为 None
+        """
+        if not len(self.onsets):
+            return None
+        i = int(np.searchsorted(self.onsets, ms))
+        candidates = self.onsets[max(i - 1, 0):i + 1]
+        nearest = candidates[np.argmin(np.abs(candidates - ms))]
+        return float(nearest) if abs(nearest - ms) <= tolerance else None
+
+
+def decode(data):
+    """
+    用 pygame 把音频（ogg/wav 等）解码为单声道 float32 采样。
+    :return: (采样数组, 采样率)
+    :raises ValueError: 无法解码
+    """
+    import pygame
+    try:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        sound = pygame.mixer.Sound(file=io.BytesIO(data))
+    except pygame.error as e:
+        raise ValueError(f"cannot decode audio: {e}") from e
+    rate = pygame.mixer.get_init()[0]
+    samples = pygame.sndarray.array(sound)
+    scale = float(np.iinfo(samples.dtype).max) if samples.dtype.kind in 'iu' else 1.0
+    samples = samples.astype(np.float32) / scale
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples, rate
+
+
+def compute_envelope(samples, rate, envelope_ms=ENVELOPE_MS):
+    window = max(int(rate * envelope_ms / 1000), 1)
+    pad = -len(samples) % window
+    peaks = np.abs(np.pad(samples, (0, pad))).reshape(-1, window).max(axis=1)
+    top = peaks.max() if len(peaks) else 0
+    return (peaks / top if top > 0 else peaks).astype(np.float32)
+
+
+def detect_onsets(samples, rate):
+    """
+    用频谱通量检测起音：相邻帧幅度谱的正向差之和，高于局部均值的局部极大值记为起音。
+    :return: 起音时间数组（毫秒）
+    """
+    if len(samples) < ONSET_FRAME:
+        return np.empty(0)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, ONSET_FRAME)[::ONSET_HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(ONSET_FRAME), axis=1))
+    flux = np.maximum(np.diff(np.log1p(spectrum), axis=0), 0).sum(axis=1)
+    flux = np.concatenate(([0.0], flux))
+    if flux.max() <= 0:
+        return np.empty(0)
+    flux /= flux.max()
+
+    # 自适应阈值：约 0.25 秒范围内的均值加上固定偏移
+    hop_ms = ONSET_HOP * 1000 / rate
+    width = max(int(250 / hop_ms), 1)
+    window = np.ones(2 * width + 1) / (2 * width + 1)
+    threshold = np.convolve(np.pad(flux, width, mode='reflect'), window, mode='valid') + ONSET_DELTA
+    neighbourhood = max(int(ONSET_MIN_GAP_MS / hop_ms), 1)
+    padded = np.pad(flux, neighbourhood, mode='constant')
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * neighbourhood + 1).max(axis=1)
+    peaks = np.flatnonzero((flux >= local_max) & (flux > threshold))
+    # 帧的起音时间取窗口中心
+    return (peaks * ONSET_HOP + ONSET_FRAME / 2) * 1000 / rate
+
+
+def analyze(data):
+    samples, rate = decode(data)
+    return AudioAnalysis(hashlib.sha1(data).hexdigest(), compute_envelope(samples, rate), ENVELOPE_MS,
+                         detect_onsets(samples, rate))
+
+
+def load_analysis(data, cache_dir):
+    """
+    读取（或计算并缓存）音频的分析结果。
+    :param data: 音频文件内容
+    :param cache_dir: 缓存目录
+    """
+    audio_hash = hashlib.sha1(data).hexdigest()
+    path = os.path.join(cache_dir, f"{audio_hash}.npz")
+    try:
+        with np.load(path) as cached:
+            if int(cached['version']) == ANALYSIS_VERSION:
+                return AudioAnalysis(audio_hash, cached['envelope'], int(cached['envelope_ms']), cached['onsets'])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    analysis = analyze(data)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(f, version=ANALYSIS_VERSION, envelope=analysis.envelope,
+                            envelope_ms=analysis.envelope_ms, onsets=analysis.onsets)
+    os.replace(tmp_path, path)
+    return analysis
@@ -0,0 +1,89 @@
+"""
+音符节拍的列式批量运算。
+
+对所有 note 的 beat 三元组 [小节数, 分子拍数, 分母拍数] 的整数列（取自
+malody_notes.NoteTable）一次性完成分数化简、绝对拍位置和分度颜色的计算。安装了 NumPy 时使用向量化实现，
+否则退回逐个音符的纯 Python 实现，结果一致。
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # 分度化简工具只依赖标准库
+    np = None
+
+# 化简后的分母（分度）对应的音符颜色，未列出的分度以及分母为 0 时为灰色
+DIVIDE_COLORS = {
+    1: 'red', 2: 'blue', 3: 'green', 4: 'purple', 6: 'green',
+    8: 'yellow', 12: 'green', 16: 'yellow', 24: 'green', 32: 'yellow'
+}
+DEFAULT_COLOR = 'gray'
+# 所有颜色类别，divide_color_ids 返回的是在此元组中的下标
+COLOR_CLASSES = ('red', 'blue', 'green', 'purple', 'yellow', DEFAULT_COLOR)
+
+
+def simplify_beats(nums, dens):
+    """
+    将分数 num/den 化简为最简形式。分子分母都为 0 时保持不变。
+    :return: (化简后的分子, 化简后的分母)
+    """
+    if np is None:
+        new_nums, new_dens = [], []
+        for n, d in zip(nums, dens):
+            g = math.gcd(n, d) or 1
+            new_nums.append(n // g)
+            new_dens.append(d // g)
+        return new_nums, new_dens
+    g = np.gcd(nums, dens)
+    g[g == 0] = 1
+    return nums // g, dens // g
+
+
+def beat_positions(measures, nums, dens):
+    """
+    计算绝对拍位置 measure + num / den，分母为 0 的音符位置为 NaN。
+    """
+    if np is None:
+        return [m + n / d if d else math.nan for m, n, d in zip(measures, nums, dens)]
+    safe_dens = np.where(dens == 0, 1, dens)
+    return np.where(dens == 0, np.nan, measures + nums / safe_dens)
+
+
+def divide_classes(nums, dens):
+    """
+    计算每个音符的分度（化简后的分母）。分子为 0 时为 1，分母为 0 时为 0。
+    """
+    if np is None:
+        return [d // math.gcd(n, d) if d else 0 for n, d in zip(nums, dens)]
+    g = np.gcd(nums, dens)
+    g[g == 0] = 1
+    return np.where(dens == 0, 0, dens // g)
+
+
+def divide_color(divide):
+    """
+    根据分度返回音符颜色。
+    """
+    return DIVIDE_COLORS.get(int(divide), DEFAULT_COLOR)
+
+
+def divide_color_ids(divides):
+    """
+    批量把分度映射为颜色类别下标（见 COLOR_CLASSES）。
+    """
+    if np is None:
+        return [COLOR_CLASSES.index(divide_color(d)) for d in divides]
+    ids = np.full(len(divides), COLOR_CLASSES.index(DEFAULT_COLOR), dtype=np.int8)
+    for divide, color in DIVIDE_COLORS.items():
+        ids[divides == divide] = COLOR_CLASSES.index(color)
+    return ids
+
+
+def beat_color(beat):
+    """
+    根据单个音符的节拍 [小节数, 分子拍数, 分母拍数] 返回颜色。
+    """
+    _, num, den = beat
+    if den == 0:
+        return DEFAULT_COLOR
+    return divide_color(den // (math.gcd(num, den) or 1))
@@ -1,11 +1,27 @@
-import json
-import math
+import argparse
+import copy
+import hashlib
 import os
 import shutil
+import signal
+import struct
 import sys
 import tempfile
+import time
 import zipfile
 import locale
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import malody_beats
+import malody_json
+import malody_notes
+import malody_profile
+import malody_watch
+
+COPY_CHUNK_SIZE = 1024 * 1024  # 复制压缩包成员时的块大小
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08  # zip 通用标志位：大小和 CRC 写在数据描述符中
+CACHE_FILE_NAME = '.malody_simplify_cache.json'  # 批处理缓存索引的默认文件名
 
 # 检测系统语言
 system_language = locale.getlocale()[0] 
@@ -44,85 +60,823 @@ translations = {
     'press_any_key': {
         'zh': "请按任意键继续",
         'en': "Press any key to continue"
+    },
+    'backup_archive_written': {
+        'zh': "{count} 个备份已写入备份压缩包: {archive}",
+        'en': "{count} backups written to the backup archive: {archive}"
+    },
+    'backup_archive_failed': {
+        'zh': "写入备份压缩包失败: {error}；本次的备份保留在 {staging}",
+        'en': "Failed to write the backup archive: {error}; this run's backups are kept in {staging}"
+    },
+    'already_simplified': {
+        'zh': "无需处理（已是最简分度）: {file}",
+        'en': "Skipped (already simplified): {file}"
+    },
+    'dry_run_file': {
+        'zh': "{file}: {changed}/{notes} 个音符将被化简，约重写 {bytes} 字节",
+        'en': "{file}: {changed}/{notes} notes would be simplified, about {bytes} bytes rewritten"
+    },
+    'dry_run_summary': {
+        'zh': "试运行（未写入任何文件）：{files} 个文件中 {touched} 个需要改写（失败 {failed} 个），{changed}/{notes} 个音符将被化简，约重写 {bytes} 字节，耗时 {elapsed:.2f} 秒\n分度分布（化简前）: {before}\n分度分布（化简后）: {after}\n音符颜色分布: {colors}",
+        'en': "Dry run (nothing written): {touched} of {files} files would be rewritten ({failed} failed), {changed}/{notes} notes simplified, about {bytes} bytes rewritten in {elapsed:.2f}s\nDivide distribution (before): {before}\nDivide distribution (after): {after}\nNote colour distribution: {colors}"
+    },
+    'watch_started': {
+        'zh': "正在监视 {dirs}（{mode}），按 Ctrl+C 停止",
+        'en': "Watching {dirs} ({mode}), press Ctrl+C to stop"
+    },
+    'watch_stopped': {
+        'zh': "已停止监视，共处理 {files} 个文件（失败 {failed} 个）",
+        'en': "Stopped watching, {files} files processed ({failed} failed)"
+    },
+    'lint_issue': {
+        'zh': "{file}: [{severity}] {rule} × {count}（音符下标: {rows}）",
+        'en': "{file}: [{severity}] {rule} x {count} (note indices: {rows})"
+    },
+    'lint_summary': {
+        'zh': "检查完成：{files} 个文件、{charts} 个谱面、{notes} 个音符，{flagged} 个谱面有问题（错误 {errors} 处，警告 {warnings} 处，无法读取 {failed} 个），耗时 {elapsed:.2f} 秒\n各规则问题数: {rules}",
+        'en': "Lint finished: {files} files, {charts} charts, {notes} notes; {flagged} charts flagged ({errors} errors, {warnings} warnings, {failed} unreadable) in {elapsed:.2f}s\nIssues per rule: {rules}"
+    },
+    'batch_summary': {
+        'zh': "共处理 {files} 个文件（失败 {failed} 个，未变化跳过 {skipped} 个），{notes} 个音符，耗时 {elapsed:.2f} 秒 | {files_per_sec:.1f} 文件/秒，{notes_per_sec:.0f} 音符/秒",
+        'en': "Processed {files} files ({failed} failed, {skipped} unchanged skipped), {notes} notes in {elapsed:.2f}s | {files_per_sec:.1f} files/s, {notes_per_sec:.0f} notes/s"
     }
 }
 
 def translate(key, **kwargs):
     return translations[key][language].format(**kwargs)
 
-def adjust_denominator(numerator, denominator):
-    gcd_val = math.gcd(numerator, denominator)
-    simplified_num = numerator // gcd_val
-    simplified_den = denominator // gcd_val
-    return simplified_num, simplified_den
+def simplify_chart(data):
+    """
+    化简谱面数据中所有音符的节奏分数（原地修改）。
+    :return: (音符数, 被改动的音符数)，改动数为 0 表示谱面已是最简形式
+    """
+    table = malody_notes.NoteTable(data.get('note', []))
+    changed = table.simplify()
+    if changed:
+        data['note'] = table.to_notes()
+    return len(table), changed
 
-def process_beat(beat):
-    measure, num, den = beat
-    adjusted_num, adjusted_den = adjust_denominator(num, den)
-    return [measure, adjusted_num, adjusted_den]
+def write_temp_file(content, target_path):
+    """
+    把内容写入与 target_path 同目录的临时文件（权限与目标文件一致），返回临时文件路径。
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + os.path.basename(target_path), dir=os.path.dirname(target_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        shutil.copymode(target_path, tmp_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
 
-def process_mc_file(mc_path, bak_dir):
+def replace_with_backup(tmp_path, target_path, bak_path):
+    """
+    用 tmp_path 原子替换 target_path，原文件保留为 bak_path。
+    优先用硬链接（原文件始终存在），不支持时改为重命名，跨磁盘时才复制。
+    """
+    if os.path.lexists(bak_path):
+        os.remove(bak_path)
+    try:
+        os.link(target_path, bak_path)
+    except OSError:
+        try:
+            os.rename(target_path, bak_path)
+        except OSError:
+            shutil.copyfile(target_path, bak_path)
+    os.replace(tmp_path, target_path)
+
+def process_mc_file(mc_path, bak_dir, compact=False):
+    """
+    化简单个 .mc 文件并原子地覆盖原文件，原文件保留为 bak_dir 下的 .bak。
+    :return: 音符数，失败时返回 None
+    """
+    tmp_path = None
     try:
         # 读取 .mc 文件数据
-        with open(mc_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with malody_profile.stage('file_read'), open(mc_path, 'rb') as f:
+            raw = f.read()
+        malody_profile.count('bytes_read', len(raw))
+        with malody_profile.stage('json_parse'):
+            data = malody_json.loads(raw)
 
-        # 处理所有音符节奏分数简化
-        for note in data.get('note', []):
-            if 'beat' in note:
-                note['beat'] = process_beat(note['beat'])
+        # 处理所有音符节奏分数简化，已是最简形式时不写入也不备份
+        with malody_profile.stage('beat_transform'):
+            note_count, changed = simplify_chart(data)
+        malody_profile.count('notes', note_count)
+        if not changed:
+            print(translate('already_simplified', file=os.path.basename(mc_path)))
+            return note_count
 
-        # 备份 .mc 文件，备份放在脚本目录（bak_dir）
+        # 先写入临时文件，再替换原文件，避免写到一半时留下损坏的谱面
+        with malody_profile.stage('serialize'):
+            content = malody_json.dumps(data, compact)
+        with malody_profile.stage('file_write'):
+            tmp_path = write_temp_file(content, mc_path)
+        malody_profile.count('bytes_written', len(content))
+        # 备份 .mc 文件，备份放在 bak_dir
         bak_path = os.path.join(bak_dir, os.path.basename(mc_path) + '.bak')
-        shutil.copyfile(mc_path, bak_path)
-
-        # 覆盖写入简化后的 .mc 文件
-        with open(mc_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-
+        replace_with_backup(tmp_path, mc_path, bak_path)
         print(translate('backup_created', file=os.path.basename(mc_path), backup=os.path.basename(bak_path)))
+        tmp_path = None
+        return note_count
 
     except Exception as e:
         print(translate('process_failed', file=os.path.basename(mc_path), error=str(e)))
+        return None
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _copy_raw_member(zin, zout, info):
+    """
+    将压缩包成员的原始压缩数据直接复制到新压缩包，不解压也不重新压缩。
+    """
+    # 超过 ZIP64 限制的成员需要改写扩展字段，交给 zipfile 按流复制
+    if info.file_size >= zipfile.ZIP64_LIMIT or info.compress_size >= zipfile.ZIP64_LIMIT:
+        with zin.open(info) as src, zout.open(copy.copy(info), 'w', force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        return
+
+    # 跳过源文件中的本地文件头，定位到压缩数据
+    zin.fp.seek(info.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader, zin.fp.read(zipfile.sizeFileHeader))
+    zin.fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~ZIP_FLAG_DATA_DESCRIPTOR  # CRC 和大小已知，直接写进本地文件头
+    new_info.header_offset = zout.fp.tell()
+    zout.fp.write(new_info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = zin.fp.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member: {info.filename}")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
 
-def process_mcz_file(mcz_path, output_dir):
+    # zipfile 没有公开的原始写入接口，需要手动登记成员并更新中央目录的起始位置
+    zout.filelist.append(new_info)
+    zout.NameToInfo[new_info.filename] = new_info
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+def _safe_member_name(name):
+    """
+    把压缩包成员名转换为安全的相对路径（与 zipfile 解压时的处理相同）：去掉盘符和开头的分隔符，
+    丢弃 '.'、'..' 和空的路径部分，拼接到任何目录下都不会超出该目录。
+    """
+    name = os.path.splitdrive(name.replace('\\', '/'))[1]
+    return os.path.join(*[part for part in name.split('/') if part not in ('', '.', '..')] or ['_'])
+
+def process_mcz_file(mcz_path, bak_dir, compact=False):
+    """
+    化简 .mcz 中的所有 .mc 并原地重写压缩包。
+    被改动的 .mc 原文备份到 bak_dir 下以压缩包命名的目录（<名称>.mcz.bak/成员路径.bak），
+    同一目录中不同压缩包的同名谱面不会互相覆盖。备份在替换压缩包之前写入。
+    :return: 音符数，失败（包括其中有谱面无法处理）时返回 None
+    """
+    tmp_path = None
     try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # 解压.mcz
-            with zipfile.ZipFile(mcz_path, 'r') as zip_ref:
-                zip_ref.extractall(tmpdir)
-
-            # 处理所有 .mc 文件
-            mc_files = []
-            for root, _, files in os.walk(tmpdir):
-                for file in files:
-                    if file.endswith('.mc'):
-                        mc_files.append(os.path.join(root, file))
-
-            if not mc_files:
+        with zipfile.ZipFile(mcz_path, 'r') as zin:
+            infos = zin.infolist()
+            mc_infos = [info for info in infos if info.filename.endswith('.mc')]
+            if not mc_infos:
                 print(translate('no_mc_files'))
-                return
+                return None
+
+            # 先在内存中处理所有 .mc，全部已是最简形式时不重写压缩包
+            note_count = 0
+            failed = False  # 有谱面无法处理时整个压缩包记为失败，不写入缓存，下次仍会重试
+            rewritten = {}
+            for info in mc_infos:
+                with malody_profile.stage('zip_read'):
+                    raw = zin.read(info)
+                malody_profile.count('bytes_read', len(raw))
+                try:
+                    with malody_profile.stage('json_parse'):
+                        data = malody_json.loads(raw)
+                    with malody_profile.stage('beat_transform'):
+                        notes, changed = simplify_chart(data)
+                except Exception as e:
+                    # 无法处理的谱面保持原样
+                    print(translate('process_failed', file=os.path.basename(info.filename), error=str(e)))
+                    failed = True
+                    continue
+                note_count += notes
+                malody_profile.count('notes', notes)
+                if changed:
+                    with malody_profile.stage('serialize'):
+                        rewritten[info.filename] = (raw, malody_json.dumps(data, compact))
+
+            if not rewritten:
+                if not failed:
+                    print(translate('already_simplified', file=os.path.basename(mcz_path)))
+                return None if failed else note_count
+
+            # 逐个成员流式重写：只有改动过的 .mc 重新压缩，其余成员（音频、图片等）按原始压缩数据复制
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + os.path.basename(mcz_path),
+                                           dir=os.path.dirname(mcz_path))
+            with malody_profile.stage('zip_write'), os.fdopen(fd, 'wb') as tmp_file, \
+                    zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_DEFLATED) as zout:
+                for info in infos:
+                    if info.filename not in rewritten:
+                        _copy_raw_member(zin, zout, info)
+                        continue
+
+                    raw, content = rewritten[info.filename]
+                    mc_name = os.path.basename(info.filename)
+                    # 成员名来自压缩包，清理后再用作备份路径，避免写到备份目录之外
+                    member_path = _safe_member_name(info.filename)
 
-            for mc_file in mc_files:
-                process_mc_file(mc_file, output_dir)
+                    new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    new_info.external_attr = info.external_attr
+                    new_info.compress_type = zipfile.ZIP_DEFLATED
+                    zout.writestr(new_info, content)
 
-            # 重新打包.mcz，排除所有.bak文件
-            new_mcz_path = os.path.join(output_dir, os.path.basename(mcz_path))
-            with zipfile.ZipFile(new_mcz_path, 'w', zipfile.ZIP_DEFLATED) as zip_write:
-                for folder, _, files in os.walk(tmpdir):
-                    for file in files:
-                        if not file.endswith('.bak'):
-                            file_path = os.path.join(folder, file)
-                            arcname = os.path.relpath(file_path, tmpdir)
-                            zip_write.write(file_path, arcname)
+                    # 备份原始 .mc 到备份目录
+                    bak_path = os.path.join(bak_dir, os.path.basename(mcz_path) + '.bak', member_path + '.bak')
+                    os.makedirs(os.path.dirname(bak_path), exist_ok=True)
+                    with open(bak_path, 'wb') as f:
+                        f.write(raw)
+                    print(translate('backup_created', file=mc_name, backup=os.path.basename(bak_path)))
 
-            print(f"重新打包完成：{os.path.basename(new_mcz_path)}")
+        # 写完后再替换，避免中途失败破坏原文件
+        malody_profile.count('bytes_written', os.path.getsize(tmp_path))
+        shutil.copymode(mcz_path, tmp_path)
+        os.replace(tmp_path, mcz_path)
+        tmp_path = None
+        print(f"重新打包完成：{os.path.basename(mcz_path)}")
+        return None if failed else note_count
 
     except Exception as e:
         print(f"处理MCZ文件失败: {e}")
+        return None
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def file_hash(path):
+    """
+    计算文件内容的 SHA-1 摘要。
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_signature(path):
+    """
+    返回缓存中记录的文件签名 {size, mtime_ns, sha1}。
+    """
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': file_hash(path)}
+
+def load_cache(cache_path):
+    """
+    读取处理缓存索引：{绝对路径: 文件签名}。文件不存在或损坏时返回空索引。
+    """
+    try:
+        cache = malody_json.load_file(cache_path)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache_path, cache):
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(cache_path)))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(malody_json.dumps(cache, compact=True))
+    os.replace(tmp_path, cache_path)
+
+def is_cached(path, entry):
+    """
+    判断文件自上次处理后是否未变化：大小和修改时间一致即视为未变化，
+    否则比较内容摘要（例如文件被复制或仅修改了时间戳）。
+    """
+    if not entry:
+        return False
+    st = os.stat(path)
+    if st.st_size == entry.get('size') and st.st_mtime_ns == entry.get('mtime_ns'):
+        return True
+    return st.st_size == entry.get('size') and file_hash(path) == entry.get('sha1')
+
+def find_chart_files(paths):
+    """
+    递归收集给定路径（文件或目录）下的所有 .mc / .mcz 文件。
+    """
+    chart_files = []
+    for path in paths:
+        if os.path.isfile(path):
+            if path.endswith(('.mc', '.mcz')):
+                chart_files.append(os.path.abspath(path))
+            continue
+        for root, _, files in os.walk(path):
+            for file in sorted(files):
+                if file.endswith(('.mc', '.mcz')):
+                    chart_files.append(os.path.abspath(os.path.join(root, file)))
+    return chart_files
+
+def process_chart_file(path, bak_dir=None, compact=False):
+    """
+    原地处理单个 .mc / .mcz 文件。bak_dir 为空时备份放在文件所在目录，否则放在 bak_dir 下
+    与文件完整路径对应的子目录中，不同目录中的同名谱面不会互相覆盖。
+    返回处理的音符数，失败时返回 None。
+    """
+    if bak_dir:
+        bak_dir = os.path.join(bak_dir, os.path.dirname(_backup_arcname(path)))
+        os.makedirs(bak_dir, exist_ok=True)
+    else:
+        bak_dir = os.path.dirname(path)
+    malody_profile.count('files')
+    if path.endswith('.mcz'):
+        return process_mcz_file(path, bak_dir, compact)
+    return process_mc_file(path, bak_dir, compact)
+
+def _process_chart_task(task):
+    path, bak_dir, compact, entry = task
+    if entry is not None and is_cached(path, entry):
+        print(translate('already_simplified', file=os.path.basename(path)))
+        return 0, file_signature(path), None
+    note_count = process_chart_file(path, bak_dir, compact)
+    # 文件已被原地处理完成时才记录签名；失败（包括压缩包中部分谱面失败）的文件下次重新处理
+    signature = file_signature(path) if note_count is not None else None
+    # 统计数据交回主进程合并
+    profile = malody_profile.snapshot(reset=True) if malody_profile.enabled else None
+    return note_count, signature, profile
+
+def _backup_arcname(path):
+    """
+    备份在压缩包中的路径：去掉盘符和开头的分隔符的绝对路径，保证不同目录的同名谱面不冲突。
+    """
+    return os.path.splitdrive(os.path.abspath(path))[1].lstrip('/\\')
+
+def write_backup_archive(archive_path, staging_dir, run_prefix):
+    """
+    把暂存目录中的备份放到 run_prefix 目录下，与备份压缩包原有的成员（按原始压缩数据复制）
+    一起写入新的临时压缩包，再原子替换旧的压缩包，成功后删除暂存目录。
+    :return: 写入的备份数
+    """
+    staged = []
+    for root, _, files in os.walk(staging_dir):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            staged.append((path, f"{run_prefix}/{os.path.relpath(path, staging_dir).replace(os.sep, '/')}"))
+    if staged:
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + os.path.basename(archive_path),
+                                        dir=os.path.dirname(archive_path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file, zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_DEFLATED) as zout:
+                if os.path.exists(archive_path):
+                    with zipfile.ZipFile(archive_path, 'r') as zin:
+                        for info in zin.infolist():
+                            _copy_raw_member(zin, zout, info)
+                for path, arcname in staged:
+                    zout.write(path, arcname)
+            os.replace(tmp_path, archive_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    shutil.rmtree(staging_dir)
+    return len(staged)
+
+def run_batch(chart_files, workers=None, bak_dir=None, cache_path=None, compact=False, backup_archive=None):
+    """
+    使用进程池批量处理谱面文件，并打印吞吐量统计。
+    :param chart_files: 待处理的文件路径列表
+    :param workers: 进程数，默认为 CPU 核心数；为 1 时在当前进程内顺序处理
+    :param bak_dir: 备份目录，默认与各文件同目录
+    :param cache_path: 处理缓存索引文件，为空时不使用缓存
+    :param compact: 为 True 时输出最小化 JSON
+    :param backup_archive: 备份压缩包路径，设置后本次运行的所有备份都写入该压缩包，不再保留 .bak 文件
+    :return: (成功文件数, 失败文件数, 音符总数)
+    """
+    workers = workers or os.cpu_count() or 1
+    start_time = time.perf_counter()
+
+    # 使用备份压缩包时，各进程先把备份写入压缩包旁边的暂存目录（谱面被替换之前备份已在磁盘上），
+    # 全部处理完后再连同原有备份写成新的压缩包替换旧的；中途崩溃时旧的压缩包不受影响，暂存目录中的备份也会保留
+    run_prefix = time.strftime('%Y%m%d-%H%M%S')
+    staging_dir = None
+    if backup_archive:
+        backup_archive = os.path.abspath(backup_archive)
+        staging_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(backup_archive)}.{run_prefix}.",
+                                       dir=os.path.dirname(backup_archive))
+        bak_dir = staging_dir
+
+    # 先在主进程做一轮 stat 检查，大小和修改时间都未变的文件直接跳过
+    cache = load_cache(cache_path) if cache_path else {}
+    skipped = 0
+    tasks = []
+    for path in chart_files:
+        entry = cache.get(path)
+        st = os.stat(path)
+        if entry and st.st_size == entry.get('size') and st.st_mtime_ns == entry.get('mtime_ns'):
+            skipped += 1
+            continue
+        # 只有启用缓存时才在子进程里比较内容摘要
+        tasks.append((path, bak_dir, compact, entry if cache_path else None))
+
+    counts = []
+
+    def collect(results):
+        for task, (count, signature, profile) in zip(tasks, results):
+            counts.append(count)
+            if profile is not None:
+                malody_profile.merge(profile)
+            if signature is not None:
+                cache[task[0]] = signature
+
+    try:
+        if workers == 1 or len(tasks) <= 1:
+            collect(map(_process_chart_task, tasks))
+        else:
+            chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+            with ProcessPoolExecutor(max_workers=workers, initializer=malody_profile.enable_in_worker) as executor:
+                collect(executor.map(_process_chart_task, tasks, chunksize=chunksize))
+    finally:
+        if staging_dir:
+            try:
+                count = write_backup_archive(backup_archive, staging_dir, run_prefix)
+                if count:
+                    print(translate('backup_archive_written', count=count, archive=backup_archive))
+            except Exception as e:
+                print(translate('backup_archive_failed', error=str(e), staging=staging_dir))
+        if cache_path:
+            save_cache(cache_path, cache)
+
+    elapsed = time.perf_counter() - start_time
+    files = len(counts) + skipped
+    failed = sum(1 for count in counts if count is None)
+    notes = sum(count for count in counts if count)
+    per_sec = 1 / elapsed if elapsed > 0 else 0
+    print(translate('batch_summary', files=files, failed=failed, skipped=skipped, notes=notes, elapsed=elapsed,
+                    files_per_sec=files * per_sec, notes_per_sec=notes * per_sec))
+    return files - failed, failed, notes
+
+def analyze_chart(data, compact=False):
+    """
+    统计谱面化简后的变化（只读分析，data 中的音符可能被替换，调用方不应再写回）。
+    :return: {notes, changed, divides_before, divides_after, colors, size}，
+             divides_* 为 {分母: 音符数}，colors 为编辑器中各颜色的音符数，
+             size 为化简后重新序列化的字节数（没有改动时为 0）
+    """
+    table = malody_notes.NoteTable(data.get('note', []))
+    rows = [row for row, flags in enumerate(table.flags) if flags & malody_notes.HAS_BEAT]
+    divides_before = Counter(table.den[row] for row in rows)
+    changed = table.simplify()
+    divides_after = Counter(table.den[row] for row in rows)
+
+    # 编辑器按化简后的分母着色，没有 beat 的音符为灰色
+    colors = Counter({malody_beats.DEFAULT_COLOR: len(table) - len(rows)})
+    for den, count in divides_after.items():
+        colors[malody_beats.divide_color(den) if den else malody_beats.DEFAULT_COLOR] += count
+
+    size = 0
+    if changed:
+        data['note'] = table.to_notes()
+        size = len(malody_json.dumps(data, compact))
+    return {'notes': len(table), 'changed': changed, 'divides_before': divides_before,
+            'divides_after': divides_after, 'colors': +colors, 'size': size}
+
+def analyze_chart_file(path, compact=False):
+    """
+    只读地分析单个 .mc / .mcz 文件。压缩包成员逐个直接从压缩包中读取，不解压到磁盘。
+    :return: 统计结果，其中 bytes 为估计的改写字节数；出错时带 error 字段
+    """
+    stats = {'path': path, 'notes': 0, 'changed': 0, 'bytes': 0, 'divides_before': Counter(),
+             'divides_after': Counter(), 'colors': Counter()}
+
+    def add(result):
+        for key in ('notes', 'changed'):
+            stats[key] += result[key]
+        for key in ('divides_before', 'divides_after', 'colors'):
+            stats[key].update(result[key])
+
+    try:
+        if not path.endswith('.mcz'):
+            with open(path, 'rb') as f:
+                result = analyze_chart(malody_json.loads(f.read()), compact)
+            add(result)
+            stats['bytes'] = result['size']
+            return stats
+
+        with zipfile.ZipFile(path, 'r') as zin:
+            old_size = new_size = 0
+            for info in zin.infolist():
+                if not info.filename.endswith('.mc'):
+                    continue
+                result = analyze_chart(malody_json.loads(zin.read(info)), compact)
+                add(result)
+                if result['changed']:
+                    # 按原成员的压缩率估计重新压缩后的大小
+                    ratio = info.compress_size / info.file_size if info.file_size else 1
+                    old_size += info.compress_size
+                    new_size += int(result['size'] * ratio)
+        if new_size:
+            # 有改动时整个压缩包会被重写
+            stats['bytes'] = os.path.getsize(path) - old_size + new_size
+    except Exception as e:
+        stats['error'] = str(e)
+    return stats
+
+def _analyze_chart_task(task):
+    return analyze_chart_file(*task)
+
+def _format_histogram(counter):
+    return ', '.join(f"{key}: {count}" for key, count in sorted(counter.items(), key=lambda item: (isinstance(item[0], str), item[0]))) or '-'
+
+def run_dry_run(chart_files, workers=None, compact=False, report_path=None):
+    """
+    试运行：并行分析所有谱面，打印将被化简的音符数、分度分布和估计的改写字节数，不写入任何谱面。
+    :param report_path: 不为空时把逐文件和汇总的统计结果写入该 JSON 文件
+    :return: 汇总统计
+    """
+    workers = workers or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    tasks = [(path, compact) for path in chart_files]
+    total = {'files': 0, 'touched': 0, 'failed': 0, 'notes': 0, 'changed': 0, 'bytes': 0,
+             'divides_before': Counter(), 'divides_after': Counter(), 'colors': Counter()}
+    files = []
+
+    def collect(results):
+        # 每个文件的结果在到达时立即汇总，内存占用与文件数量无关（写报告时除外）
+        for stats in results:
+            total['files'] += 1
+            if 'error' in stats:
+                total['failed'] += 1
+                print(translate('process_failed', file=os.path.basename(stats['path']), error=stats['error']))
+            else:
+                total['touched'] += 1 if stats['changed'] else 0
+                for key in ('notes', 'changed', 'bytes'):
+                    total[key] += stats[key]
+                for key in ('divides_before', 'divides_after', 'colors'):
+                    total[key].update(stats[key])
+                if stats['changed']:
+                    print(translate('dry_run_file', file=os.path.basename(stats['path']), changed=stats['changed'],
+                                    notes=stats['notes'], bytes=stats['bytes']))
+            if report_path:
+                files.append(stats)
+
+    if workers == 1 or len(tasks) <= 1:
+        collect(map(_analyze_chart_task, tasks))
+    else:
+        chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            collect(executor.map(_analyze_chart_task, tasks, chunksize=chunksize))
+
+    elapsed = time.perf_counter() - start_time
+    print(translate('dry_run_summary', files=total['files'], touched=total['touched'], failed=total['failed'],
+                    changed=total['changed'], notes=total['notes'], bytes=total['bytes'], elapsed=elapsed,
+                    before=_format_histogram(total['divides_before']),
+                    after=_format_histogram(total['divides_after']),
+                    colors=_format_histogram(total['colors'])))
+    if report_path:
+        # JSON 的键必须是字符串
+        report = {'summary': total, 'files': files}
+        for stats in [total] + files:
+            for key in ('divides_before', 'divides_after', 'colors'):
+                stats[key] = {str(k): v for k, v in stats[key].items()}
+        malody_json.dump_file(report, report_path)
+    return total
+
+def run_lint(chart_files, workers=None, report_path=None, rules=None):
+    """
+    并行检查所有谱面（见 malody_lint），打印发现的问题和汇总，不写入任何谱面。
+    :param report_path: 不为空时以 JSON Lines 格式写出报告：每个谱面一行，最后一行为汇总 {"summary": ...}。
+                        结果到达时立即写出，内存占用与谱面数量无关
+    :param rules: 只运行这些规则
+    :return: 汇总统计
+    """
+    import malody_lint  # 依赖 NumPy，只在检查时导入
+    unknown = set(rules or ()) - {name for name, _, _ in malody_lint.RULES}
+    if unknown:
+        sys.exit(f"unknown lint rules: {', '.join(sorted(unknown))}")
+
+    start_time = time.perf_counter()
+    total = {'files': len(chart_files), 'charts': 0, 'notes': 0, 'flagged': 0, 'failed': 0, 'errors': 0,
+             'warnings': 0, 'rules': Counter()}
+    report = open(report_path, 'wb') if report_path else None
+    try:
+        for result in malody_lint.iter_lint(chart_files, workers, rules):
+            name = os.path.basename(result['path'])
+            if result['chart']:
+                name = f"{name}/{result['chart']}"
+            if 'error' in result:
+                total['failed'] += 1
+                print(translate('process_failed', file=name, error=result['error']))
+            else:
+                total['charts'] += 1
+                total['notes'] += result['notes']
+                total['flagged'] += 1 if result['issues'] else 0
+                for issue in result['issues']:
+                    total['errors' if issue['severity'] == malody_lint.ERROR else 'warnings'] += issue['count']
+                    total['rules'][issue['rule']] += issue['count']
+                    print(translate('lint_issue', file=name, severity=issue['severity'], rule=issue['rule'],
+                                    count=issue['count'], rows=', '.join(map(str, issue['rows']))))
+            if report is not None:
+                report.write(malody_json.dumps(result, compact=True) + b'\n')
+        elapsed = time.perf_counter() - start_time
+        if report is not None:
+            report.write(malody_json.dumps({'summary': dict(total, elapsed=elapsed)}, compact=True) + b'\n')
+    finally:
+        if report is not None:
+            report.close()
+    print(translate('lint_summary', files=total['files'], charts=total['charts'], notes=total['notes'],
+                    flagged=total['flagged'], errors=total['errors'], warnings=total['warnings'],
+                    failed=total['failed'], elapsed=elapsed, rules=_format_histogram(total['rules'])))
+    return total
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _init_watch_worker():
+    # Ctrl+C 只由主进程处理，子进程完成手头的文件后随进程池退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    malody_profile.enable_in_worker()
+
+def run_watch(directories, workers=None, bak_dir=None, cache_path=None, compact=False, debounce=2.0, poll_interval=2.0):
+    """
+    持续监视目录，化简新增或修改过的谱面，直到按 Ctrl+C。
+    启动时先检查目录中已有的谱面；处理结果记录在缓存索引中，重启后未变化的文件不会重新处理。
+    :param debounce: 文件最后一次变化后等待的秒数，期间大小或修改时间变化会重新计时
+    :param poll_interval: inotify 不可用时扫描目录的间隔（秒）
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2  # 提交到进程池但未完成的任务上限
+    watcher = malody_watch.create_watcher(directories, poll_interval)
+    print(translate('watch_started', dirs=', '.join(directories), mode=watcher.mode))
+
+    cache = load_cache(cache_path) if cache_path else {}
+    pending = {path: (0, None) for path in find_chart_files(directories)}  # 路径 -> (最后变化时间, 当时的状态)
+    running = {}  # future -> 路径
+    dirty = set()  # 处理期间又发生变化的文件
+    processed = failed = 0
+
+    def dispatch(executor):
+        now = time.monotonic()
+        for path, (seen, state) in list(pending.items()):
+            if len(running) >= max_in_flight:
+                break
+            if now - seen < debounce:
+                continue
+            current = _file_state(path)
+            if state is not None and current != state:
+                pending[path] = (now, current)  # 仍在写入
+                continue
+            del pending[path]
+            if current is None:
+                cache.pop(path, None)  # 文件已被删除或移走
+                continue
+            entry = cache.get(path)
+            if entry and current == (entry.get('size'), entry.get('mtime_ns')):
+                continue  # 未变化（包括刚被本程序改写的文件）
+            task = (path, bak_dir, compact, entry if cache_path else None)
+            running[executor.submit(_process_chart_task, task)] = path
+
+    def collect(done):
+        nonlocal processed, failed
+        for future in done:
+            path = running.pop(future)
+            try:
+                count, signature, profile = future.result()
+            except Exception as e:
+                count, signature, profile = None, None, None
+                print(translate('process_failed', file=os.path.basename(path), error=str(e)))
+            if profile is not None:
+                malody_profile.merge(profile)
+            processed += 1
+            failed += count is None
+            if signature is not None:
+                cache[path] = signature
+            if path in dirty:
+                dirty.discard(path)
+                pending[path] = (time.monotonic(), _file_state(path))
+        if cache_path and done:
+            save_cache(cache_path, cache)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_watch_worker) as executor:
+            while True:
+                dispatch(executor)
+                # 有待处理的文件时只短暂等待事件，以便按时派发和收集结果
+                timeout = 0.2 if pending or running else None
+                for path in watcher.poll(timeout):
+                    path = os.path.abspath(path)
+                    if path in running.values():
+                        dirty.add(path)
+                    else:
+                        pending[path] = (time.monotonic(), _file_state(path))
+                if running:
+                    done, _ = wait(list(running), timeout=0)
+                    collect(done)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if cache_path:
+            save_cache(cache_path, cache)
+        print(translate('watch_stopped', files=processed, failed=failed))
+
+def default_cache_path(paths):
+    """
+    缓存索引默认放在第一个给定目录（或第一个文件所在目录）下。
+    """
+    first = os.path.abspath(paths[0])
+    library_dir = first if os.path.isdir(first) else os.path.dirname(first)
+    return os.path.join(library_dir, CACHE_FILE_NAME)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Malody Catch 谱面分度化简工具 / Malody Catch chart simplification tool")
+    parser.add_argument('paths', nargs='*',
+                        help="要处理的 .mc/.mcz 文件或目录（递归查找）；留空时处理脚本所在目录（--dry-run、--lint 时直接分析，否则交互确认）")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="并行进程数，默认为 CPU 核心数")
+    parser.add_argument('--bak-dir', default=None,
+                        help="备份目录，默认与各谱面文件同目录；备份按谱面的完整路径存放，同名谱面不会互相覆盖")
+    parser.add_argument('--backup-archive', default=None,
+                        help="把本次运行的所有备份写入该 zip 压缩包（放在以运行时间命名的目录下），而不是保留 .bak 文件；"
+                             "处理期间备份先写入压缩包旁边的暂存目录，运行结束后才写入压缩包")
+    parser.add_argument('--cache', default=None,
+                        help=f"处理缓存索引文件，默认为第一个目录下的 {CACHE_FILE_NAME}")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="不读取也不更新处理缓存")
+    parser.add_argument('--compact', action='store_true',
+                        help="输出不带缩进的最小化 JSON（保留键顺序和非 ASCII 文本）")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="只分析不写入：统计将被化简的音符数、化简前后的分度分布和估计的改写字节数")
+    parser.add_argument('--report', default=None,
+                        help="与 --dry-run 一起使用时把逐文件的统计结果写入该 JSON 文件；"
+                             "与 --lint 一起使用时写入 JSON Lines 格式的检查报告")
+    parser.add_argument('--lint', action='store_true',
+                        help="只检查不写入：分母为 0 或负数、x 超出范围、重叠的音符、未按拍排序、endbeat 早于 beat 等问题"
+                             "（需要 NumPy）；发现错误时退出码为 1")
+    parser.add_argument('--rules', nargs='+', default=None, metavar='RULE',
+                        help="与 --lint 一起使用，只运行这些规则")
+    parser.add_argument('--watch', action='store_true',
+                        help="持续监视给定目录，自动化简新增或修改的谱面（Linux 上使用 inotify，否则定时扫描）")
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help="监视模式下文件停止变化多少秒后才处理，默认 2 秒")
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help="监视模式下不能使用 inotify 时扫描目录的间隔秒数，默认 2 秒")
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='OUTPUT',
+                        help=f"统计各阶段耗时和读写量；OUTPUT 为 .json 时写入该文件，为 .prof 时另外保存 cProfile 数据，"
+                             f"省略时输出到标准错误（也可以设置环境变量 {malody_profile.ENV_VAR}）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 这些选项只在分析或检查模式下有意义，单独给出时报错，而不是被忽略后进入改写
+    if args.rules and not args.lint:
+        sys.exit("--rules requires --lint")
+    if args.report and not (args.dry_run or args.lint):
+        sys.exit("--report requires --dry-run or --lint")
+    if args.profile:
+        malody_profile.start(args.profile)
+    else:
+        malody_profile.start_from_env()
+
+    if args.watch:
+        directories = [os.path.abspath(path) for path in args.paths]
+        if not directories or not all(os.path.isdir(path) for path in directories):
+            sys.exit("--watch requires one or more directories")
+        cache_path = None if args.no_cache else args.cache or default_cache_path(directories)
+        run_watch(directories, args.workers, args.bak_dir, cache_path, args.compact, args.debounce, args.poll_interval)
+        return
 
-def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # 只分析不写入的模式不能落入交互式改写：没有给出路径时分析或检查脚本所在目录中的谱面
+    if args.dry_run or args.lint:
+        chart_files = find_chart_files(args.paths) if args.paths else \
+            [os.path.join(script_dir, f) for f in sorted(os.listdir(script_dir)) if f.endswith(('.mc', '.mcz'))]
+        if not chart_files:
+            print(translate('no_mc_files'))
+            sys.exit(1)
+        if args.dry_run:
+            run_dry_run(chart_files, args.workers, args.compact, args.report)
+            sys.exit(0)
+        total = run_lint(chart_files, args.workers, args.report, args.rules)
+        sys.exit(1 if total['errors'] or total['failed'] else 0)
+
+    # 指定了路径时以非交互的批处理模式运行
+    if args.paths:
+        chart_files = find_chart_files(args.paths)
+        if not chart_files:
+            print(translate('no_mc_files'))
+            sys.exit(1)
+        cache_path = None
+        if not args.no_cache:
+            cache_path = args.cache or default_cache_path(args.paths)
+        _, failed, _ = run_batch(chart_files, args.workers, args.bak_dir, cache_path, args.compact, args.backup_archive)
+        sys.exit(1 if failed else 0)
+
     os.chdir(script_dir)
 
     # 查找 .mc 和 .mcz 文件
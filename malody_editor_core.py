@@ -0,0 +1,622 @@
+"""
+曲线编辑器的计算部分：分度吸附、x 坐标归一化、曲线拟合与音符生成、变速换算、
+音符索引和编辑记录。
+
+不依赖 matplotlib、pygame 或 tkinter，可以在批处理脚本中直接导入；
+scipy 只在第一次拟合曲线时导入。编辑器（catch_curve_editor）从这里导入这些函数和类。
+"""
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+import malody_beats
+import malody_notes
+import malody_profile
+from malody_notes import NoteTable
+
+# ----- 配置项 -----
+X_TARGET_RANGE = 512
+ENABLE_SNAP = True  # 时间分度吸附是否开启（始终开启）
+DEFAULT_BPM = 120  # 默认 BPM（谱面没有 time 段时使用）
+MAX_UNDO = 200  # 每个谱面保留的撤销步数
+CHECKPOINT_INTERVAL = 50  # 每记录多少次编辑整理一次编辑记录
+
+
+def get_note_color_by_divide(beat):
+    """
+    根据时间分度获取音符颜色。
+    :param beat: 音符的节拍信息，格式为 [小节数, 分子拍数, 分母拍数]。
+    :return: 对应的颜色。
+    """
+    return malody_beats.beat_color(beat)
+
+def snap_beat(beat, divide):
+    """
+    将节拍吸附到当前分度网格上。
+    :param beat: 节拍 [小节数, 分子拍数, 分母拍数]
+    :param divide: 当前分度，例如 [1, 4]
+    :return: 吸附后的节拍 [小节数, 分子拍数, 分度]
+    """
+    if not ENABLE_SNAP:
+        return beat
+    grid = divide[1]
+    ticks = round((beat[0] + beat[1] / beat[2]) * grid)
+    return [ticks // grid, ticks % grid, grid]
+def x_transform(x_min, x_max):
+    """
+    计算把 [x_min, x_max] 映射到 [0, X_TARGET_RANGE] 的变换。
+    :return: (offset, scale)，映射为 (x - offset) * scale
+    """
+    scale = X_TARGET_RANGE / (x_max - x_min) if x_max != x_min else 1
+    return x_min, scale
+
+def normalize_x(notes):
+    """
+    归一化 note 的 x 坐标到指定范围 [0, X_TARGET_RANGE]。
+    :param notes: NoteTable（x 范围在导入时已统计，缩放是一次数组运算）或音符 dict 列表
+    :return: 坐标归一化后的音符（原地修改），范围已经一致时不做任何改动
+    """
+    if isinstance(notes, NoteTable):
+        bounds = notes.x_bounds()
+        if bounds is None:
+            return notes
+        offset, scale = x_transform(*bounds)
+        if offset == 0 and scale == 1:
+            return notes
+        xs = notes.column('x')
+        has_x = notes.mask(malody_notes.HAS_X)
+        xs[has_x] = ((xs[has_x] - offset) * scale).astype(xs.dtype)  # 与 int() 一样向零取整
+        notes.x_min, notes.x_max = 0, int((bounds[1] - offset) * scale)
+        return notes
+
+    xs = [n['x'] for n in notes if 'x' in n]
+    if not xs:
+        return notes
+    offset, scale = x_transform(min(xs), max(xs))
+    if offset == 0 and scale == 1:
+        return notes
+    for n in notes:
+        if 'x' in n:
+            n['x'] = int((n['x'] - offset) * scale)
+    return notes
+
+def merge_spans(starts, ends, gap=0):
+    """
+    合并重叠（或间隔不超过 gap）的区间，starts 需已排序。
+    :return: (合并后的起点数组, 终点数组)
+    """
+    if not len(starts):
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] > reach[:-1] + gap) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(starts) - 1]))
+    return starts[first], reach[last]
+
+class CurveFitCache:
+    """
+    分段三次曲线拟合的缓存。
+
+    曲线在相邻两个关键点之间是一段三次 Hermite 多项式，端点斜率由左右相邻关键点决定，
+    因此每段只取决于它前后共 4 个关键点和 shape_factor。各段系数按这些值缓存，
+    增加、删除或拖动一个关键点时只有附近几段需要重新计算。
+    """
+
+    def __init__(self, max_segments=4096):
+        self.max_segments = max_segments
+        self.segments = OrderedDict()  # (前一点, 起点, 终点, 后一点, shape_factor) -> 三次系数
+
+    def fit(self, points, shape_factor):
+        """
+        :param points: 关键点列表 [(x1, y1), (x2, y2), ...]，y 为拍位置
+        :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
+        :return: (PPoly 曲线, 起始拍位置, 结束拍位置)，有效关键点少于 2 个时返回 None
+        """
+        # 按拍位置排序，同一拍位置只保留最后放置的点
+        by_beat = {float(y): float(x) for x, y in points}
+        if len(by_beat) < 2:
+            return None
+        ys = sorted(by_beat)
+        pts = [(y, by_beat[y]) for y in ys]
+        shape_factor = float(np.clip(shape_factor, 0, 1))
+
+        keys = [(pts[i - 1] if i else None, pts[i], pts[i + 1], pts[i + 2] if i + 2 < len(pts) else None, shape_factor)
+                for i in range(len(pts) - 1)]
+        missing = [key for key in keys if key not in self.segments]
+        if missing:
+            with malody_profile.stage('spline_fit'):
+                for key, coeffs in zip(missing, self._fit_segments(missing).T.tolist()):
+                    self.segments[key] = coeffs
+            malody_profile.count('segments_fitted', len(missing))
+        for key in keys:
+            self.segments.move_to_end(key)
+        while len(self.segments) > max(self.max_segments, len(keys)):
+            self.segments.popitem(last=False)
+
+        from scipy.interpolate import PPoly  # scipy 导入较慢，第一次拟合时才导入
+
+        coeffs = np.array([self.segments[key] for key in keys]).T
+        return PPoly(coeffs, np.array(ys)), ys[0], ys[-1]
+
+    @staticmethod
+    def _fit_segments(keys):
+        """
+        批量计算若干段的三次系数（按降幂排列，形状为 (4, 段数)）。
+        """
+        def neighbour(point, fallback):
+            return point if point is not None else fallback
+
+        prev = np.array([neighbour(k[0], k[1]) for k in keys])
+        start = np.array([k[1] for k in keys])
+        end = np.array([k[2] for k in keys])
+        after = np.array([neighbour(k[3], k[2]) for k in keys])
+        # shape_factor 控制端点斜率：0 为水平切线（缓入缓出），0.5 为 Catmull-Rom，1 为两倍斜率
+        tension = 2 * np.array([k[4] for k in keys])
+
+        h = end[:, 0] - start[:, 0]
+        m0 = tension * (end[:, 1] - prev[:, 1]) / (end[:, 0] - prev[:, 0])
+        m1 = tension * (after[:, 1] - start[:, 1]) / (after[:, 0] - start[:, 0])
+        p0, p1 = start[:, 1], end[:, 1]
+        return np.array([
+            (2 * (p0 - p1) + h * (m0 + m1)) / h ** 3,
+            (3 * (p1 - p0) - h * (2 * m0 + m1)) / h ** 2,
+            m0,
+            p0,
+        ])
+
+curve_fit_cache = CurveFitCache()
+
+def fit_curve(points, shape_factor):
+    """
+    根据关键点拟合 x 关于拍位置的平滑曲线（分段三次，按段缓存）。
+
+    :param points: 关键点列表 [(x1, y1), (x2, y2), ...]，y 为拍位置
+    :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
+    :return: (曲线, 起始拍位置, 结束拍位置)，有效关键点少于 2 个时返回 None
+    """
+    return curve_fit_cache.fit(points, shape_factor)
+
+@lru_cache(maxsize=32)
+def _sample_curve(points, density, shape_factor):
+    fit = fit_curve(points, shape_factor)
+    if fit is None:
+        return np.empty(0), np.empty(0)
+    curve, y_start, y_end = fit
+    ynew = np.linspace(y_start, y_end, density * (len(points) - 1))
+    return curve(ynew), ynew
+
+def preview_curve(points, density, shape_factor):
+    """
+    返回曲线预览的采样点 (xs, ys)，结果按 (关键点, density, shape_factor) 缓存。
+    """
+    return _sample_curve(tuple(points), density, shape_factor)
+
+def generate_curve(points, density, shape_factor):
+    """
+    根据关键点生成平滑曲线的点列表。
+
+    :param points: 关键点列表 [(x1, y1), (x2, y2), ...]
+    :param density: 每段生成的点数量
+    :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
+    :return: 曲线点列表 [(x, y), ...]
+    """
+    xnew, ynew = preview_curve(points, density, shape_factor)
+    return list(zip(xnew, ynew))
+
+def generate_and_place_notes(points, divide, density, shape_factor, index=None):
+    """
+    根据关键点生成曲线并放置音符。
+
+    曲线按拍位置一次性批量求值：采样点吸附到当前分度网格并去重，
+    同一拍位置、同一 x 上已有音符时跳过（其它 x 上的音符不影响），
+    返回的音符按拍位置排好序，可一次并入 NoteIndex。
+
+    :param points: 关键点列表 [(x1, y1), (x2, y2), ...]
+    :param divide: 当前分度，例如 [1, 4]
+    :param density: 每段采样的点数量
+    :param shape_factor: 曲线形状控制滑条值，范围 [0, 1]
+    :param index: 当前谱面的 NoteIndex，用于跳过与已有音符重叠的位置
+    :return: 生成的音符列表
+    """
+    fit = fit_curve(points, shape_factor)
+    if fit is None:
+        return []
+    curve, y_start, y_end = fit
+
+    # 采样并吸附到分度网格（以 1/grid 拍为单位的整数刻度），重复的刻度只保留一个
+    grid = divide[1] // divide[0]
+    samples = np.linspace(y_start, y_end, max(density * (len(points) - 1), 2))
+    ticks = np.unique(np.rint(samples * grid).astype(np.int64))
+    xs = np.clip(np.rint(curve(ticks / grid)), 0, X_TARGET_RANGE).astype(np.int64)
+    if index is not None:
+        keep = ~index.occupied(ticks / grid, xs)
+        ticks, xs = ticks[keep], xs[keep]
+    if not len(ticks):
+        return []
+
+    measures, nums = np.divmod(ticks, grid)
+    return [{"beat": [m, n, grid], "x": x} for m, n, x in zip(measures.tolist(), nums.tolist(), xs.tolist())]
+
+class TimingMap:
+    """
+    拍位置与谱面时间（毫秒）之间的换算，支持谱面 time 段中的变速。
+
+    offset 为音频中拍位置 0 对应的时间（取自谱面音频音符的 offset）。
+    """
+
+    def __init__(self, time_points, offset=0, default_bpm=None):
+        points = []
+        for point in time_points:
+            beat = point.get('beat')
+            if beat and beat[2] and point.get('bpm', 0) > 0:
+                points.append((beat[0] + beat[1] / beat[2], float(point['bpm'])))
+        points.sort()
+        if not points:
+            points = [(0.0, float(default_bpm or DEFAULT_BPM))]
+        if points[0][0] > 0:
+            points.insert(0, (0.0, points[0][1]))  # 第一个变速点之前沿用它的 BPM
+
+        self.offset = offset
+        self.beats = np.array([beat for beat, _ in points])
+        self.bpms = np.array([bpm_value for _, bpm_value in points])
+        # 每个变速点相对拍位置 0 的时间
+        durations = np.diff(self.beats) * 60000 / self.bpms[:-1]
+        self.times = np.concatenate(([0.0], np.cumsum(durations)))
+
+    @classmethod
+    def from_chart(cls, data):
+        """
+        从 .mc 谱面数据构造。
+        """
+        offset = 0
+        for note in data.get('note', []):
+            if note.get('type') == 1 and 'sound' in note:
+                offset = note.get('offset', 0)
+                break
+        return cls(data.get('time', []), offset)
+
+    def beat_to_ms(self, beat):
+        """
+        :param beat: 拍位置，可以是数组
+        """
+        i = np.maximum(np.searchsorted(self.beats, beat, side='right') - 1, 0)
+        return self.offset + self.times[i] + (beat - self.beats[i]) * 60000 / self.bpms[i]
+
+    def ms_to_beat(self, ms):
+        """
+        :param ms: 谱面时间（毫秒），可以是数组
+        """
+        t = ms - self.offset
+        i = np.maximum(np.searchsorted(self.times, t, side='right') - 1, 0)
+        return self.beats[i] + (t - self.times[i]) * self.bpms[i] / 60000
+
+class NoteIndex:
+    """
+    按绝对拍位置排序的音符索引，建立在 NoteTable 之上。
+
+    rows 是按拍位置排好序的行号，positions/xs/ends/color_ids 是与之对齐的列：
+    拍位置、x 坐标、长条结束位置（非长条为 NaN）和颜色类别。
+    视口查询用二分查找，复杂度 O(log n + k)。
+    xs 是谱面中的原始坐标，x_transform 为显示时使用的 (offset, scale)。
+
+    缩小显示时使用多分辨率的密度金字塔：第 0 层把拍位置按 LOD_BASE_BIN 拍、
+    x 按 LOD_X_BINS 列分格计数，之后每层把相邻两行合并。每层只保存有音符的行
+    （稀疏存储，内存与音符数成正比，与谱面长度无关），只在用到时构建，
+    音符变化后作废，下次用到时重新构建。
+    """
+    LOD_BASE_BIN = 1 / 8  # 第 0 层每行的拍数
+    LOD_X_BINS = 32  # x 方向的格数
+
+    def __init__(self, table, x_transform=(0, 1)):
+        self.table = table
+        self.x_transform = x_transform
+        self._lod_bins = None  # 第 0 层的 (行号, 列号)，按行号排序
+        self._lod_levels = {}  # 层号 -> (有音符的行号, 各行的计数)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.positions = np.empty(0)
+        self.xs = np.empty(0)
+        self.ends = np.empty(0)
+        self.color_ids = np.empty(0, dtype=np.int8)
+        self._insert(np.arange(len(table)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _columns(self, rows):
+        """计算表中给定行的各列，跳过已删除、没有 beat 或分母为 0 的音符。"""
+        table = self.table
+        dens = table.column('den')[rows].astype(np.int64)
+        flags = table.column('flags')[rows]
+        valid = (flags & malody_notes.HAS_BEAT != 0) & (flags & malody_notes.DELETED == 0) & (dens != 0)
+        rows = rows[valid]
+        dens = dens[valid]
+        nums = table.column('num')[rows].astype(np.int64)
+        positions = malody_beats.beat_positions(table.column('measure')[rows].astype(np.int64), nums, dens)
+        color_ids = malody_beats.divide_color_ids(malody_beats.divide_classes(nums, dens))
+        xs = np.where(table.mask(malody_notes.HAS_X)[rows], table.column('x')[rows], np.nan)
+
+        ends = np.full(len(rows), np.nan)
+        holds = table.mask(malody_notes.HAS_ENDBEAT)[rows]
+        hold_rows = rows[holds]
+        ends[holds] = malody_beats.beat_positions(table.column('end_measure')[hold_rows].astype(np.int64),
+                                                  table.column('end_num')[hold_rows].astype(np.int64),
+                                                  table.column('end_den')[hold_rows].astype(np.int64))
+        return rows, positions, xs, ends, color_ids
+
+    def _insert(self, rows):
+        rows, positions, xs, ends, color_ids = self._columns(np.asarray(rows, dtype=np.int64))
+        if not len(rows):
+            return
+        order = np.argsort(positions, kind='stable')
+        rows, positions, xs, ends, color_ids = rows[order], positions[order], xs[order], ends[order], color_ids[order]
+
+        # 新音符块按位置归并进已排序序列，同一位置的音符排在原有音符之后
+        slots = np.searchsorted(self.positions, positions, side='right')
+        self.rows = np.insert(self.rows, slots, rows)
+        self.positions = np.insert(self.positions, slots, positions)
+        self.xs = np.insert(self.xs, slots, xs)
+        self.ends = np.insert(self.ends, slots, ends)
+        self.color_ids = np.insert(self.color_ids, slots, color_ids)
+        self._lod_bins = None
+        self._lod_levels = {}
+
+    def display_xs(self, lo, hi):
+        """
+        返回排序序列中 [lo, hi) 的音符在编辑器中显示的 x 坐标。
+        """
+        offset, scale = self.x_transform
+        xs = self.xs[lo:hi]
+        return xs if offset == 0 and scale == 1 else (xs - offset) * scale
+
+    def _lod_level(self, level):
+        """
+        构建（或取出缓存的）金字塔第 level 层。
+        :return: (有音符的行号数组（升序）, 计数数组，形状为 (行数, LOD_X_BINS))
+        """
+        if self._lod_bins is None:
+            # positions 已排序，筛选后的行号也是升序的
+            valid = ~np.isnan(self.xs) & (self.positions >= 0)
+            rows = (self.positions[valid] / self.LOD_BASE_BIN).astype(np.int64)
+            offset, scale = self.x_transform
+            cols = np.clip(((self.xs[valid] - offset) * scale * self.LOD_X_BINS / X_TARGET_RANGE).astype(np.int64),
+                           0, self.LOD_X_BINS - 1)
+            self._lod_bins = rows, cols
+            self._lod_levels = {}
+        if level not in self._lod_levels:
+            rows, cols = self._lod_bins
+            rows = rows >> level
+            starts = np.flatnonzero(np.diff(rows, prepend=-1))
+            groups = np.cumsum(np.diff(rows, prepend=rows[:1]) != 0)
+            counts = np.bincount(groups * self.LOD_X_BINS + cols, minlength=len(starts) * self.LOD_X_BINS)
+            self._lod_levels[level] = rows[starts], counts.reshape(len(starts), self.LOD_X_BINS).astype(np.uint32)
+        return self._lod_levels[level]
+
+    def density(self, y_min, y_max, max_rows):
+        """
+        返回拍位置范围 [y_min, y_max] 内的音符密度格（行数不超过 max_rows + 2）。
+        :return: (计数数组，形状为 (行数, LOD_X_BINS), 起始拍位置, 结束拍位置)
+        """
+        span = max(y_max - y_min, self.LOD_BASE_BIN)
+        level = max(0, int(np.ceil(np.log2(span / (max(max_rows, 1) * self.LOD_BASE_BIN)))))
+        if self._lod_bins is None:
+            self._lod_level(0)
+        bins = self._lod_bins[0]
+        top = int(bins[-1]) if len(bins) else 0
+        level = min(level, top.bit_length())  # 最高一层只有一行
+        rows, counts = self._lod_level(level)
+        size = self.LOD_BASE_BIN * 2 ** level
+        end = (top >> level) + 1
+        lo = min(max(int(np.floor(y_min / size)), 0), end)
+        hi = min(max(int(np.ceil(y_max / size)), lo), end)
+        grid = np.zeros((hi - lo, self.LOD_X_BINS), dtype=np.uint32)
+        first, last = np.searchsorted(rows, (lo, hi))
+        grid[rows[first:last] - lo] = counts[first:last]
+        return grid, lo * size, hi * size
+
+    def add(self, notes, display=False):
+        """
+        追加一批音符 dict（同时追加到音符表）。
+        :param display: 为 True 时 notes 的 x 是显示坐标（例如曲线生成的音符），按 x_transform 换算回谱面坐标
+        """
+        offset, scale = self.x_transform
+        if display and (offset, scale) != (0, 1):
+            notes = [dict(note, x=int(round(note['x'] / scale + offset))) if 'x' in note else note for note in notes]
+        start = len(self.table)
+        self.table.extend(notes)
+        self._insert(np.arange(start, len(self.table)))
+
+    def remove(self, rows):
+        """
+        从索引中移除若干行（音符表不变）。
+        """
+        keep = ~np.isin(self.rows, rows)
+        self.rows, self.positions, self.xs = self.rows[keep], self.positions[keep], self.xs[keep]
+        self.ends, self.color_ids = self.ends[keep], self.color_ids[keep]
+        self._lod_bins = None
+        self._lod_levels = {}
+
+    def refresh(self, rows):
+        """
+        音符表中若干行被修改（或恢复）后，重新计算它们在索引中的位置。
+        """
+        self.remove(rows)
+        self._insert(rows)
+
+    def nearest(self, x, y, y_min, y_max, x_tolerance, y_tolerance):
+        """
+        查找显示范围内离 (x, y) 最近的音符（x 为显示坐标）。
+        :return: 行号，容差范围内没有音符时为 None
+        """
+        lo, hi = self.window(max(y - y_tolerance, y_min), min(y + y_tolerance, y_max))
+        if lo >= hi:
+            return None
+        xs = self.display_xs(lo, hi)
+        distances = np.hypot(np.nan_to_num(xs - x, nan=np.inf) / x_tolerance, (self.positions[lo:hi] - y) / y_tolerance)
+        nearest = int(np.argmin(distances))
+        return int(self.rows[lo + nearest]) if distances[nearest] <= 1 else None
+
+    def occupied(self, positions, xs=None, tolerance=1e-9):
+        """
+        判断给定的拍位置上是否已有音符。
+        :param xs: 与 positions 对应的显示 x 坐标；给出时只有同一拍位置、同一 x 上已有音符才算
+                   （与 malody_lint 的 overlapping-notes 规则一致）
+        :return: 布尔数组
+        """
+        positions = np.asarray(positions, dtype=float)
+        lo = np.searchsorted(self.positions, positions - tolerance, side='left')
+        hi = np.searchsorted(self.positions, positions + tolerance, side='right')
+        if xs is None:
+            return hi > lo
+
+        # 展开每个位置上的已有音符，与按 add 相同的方式换算回谱面坐标的 x 比较
+        offset, scale = self.x_transform
+        xs = np.asarray(xs, dtype=float)
+        if (offset, scale) != (0, 1):
+            xs = np.rint(xs / scale + offset)
+        counts = hi - lo
+        owners = np.repeat(np.arange(len(positions)), counts)
+        candidates = np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        same = self.xs[candidates] == xs[owners]
+        return np.bincount(owners[same], minlength=len(positions)) > 0
+
+    def window(self, y_min, y_max):
+        """
+        返回拍位置在 [y_min, y_max] 内的音符在排序序列中的下标范围 (lo, hi)。
+        """
+        lo = int(np.searchsorted(self.positions, y_min, side='left'))
+        hi = int(np.searchsorted(self.positions, y_max, side='right'))
+        return lo, hi
+
+class EditLog:
+    """
+    谱面的编辑记录，支持撤销/重做。
+
+    每次编辑只记录受影响的行号和被改动的列值（插入、删除、移动），撤销和重做的
+    开销与编辑的规模成正比。删除的行在音符表中只做标记，导出时跳过；每隔
+    CHECKPOINT_INTERVAL 次编辑整理一次：丢弃超出 MAX_UNDO 的旧记录，删除行较多时
+    压缩音符表，长时间编辑时内存占用不随编辑次数增长。
+    """
+    MOVE_COLUMNS = ('measure', 'num', 'den', 'x')
+
+    def __init__(self, index, max_undo=None, checkpoint_interval=None):
+        self.index = index
+        self.max_undo = max_undo or MAX_UNDO
+        self.checkpoint_interval = checkpoint_interval or CHECKPOINT_INTERVAL
+        self.undo_stack = []  # (操作, 行号数组, 修改前的列值, 修改后的列值)
+        self.redo_stack = []
+        self.edits_since_checkpoint = 0
+        self.listeners = []  # 音符表每次变化后以 malody_journal 格式的记录调用 listener(record)
+
+    @property
+    def table(self):
+        return self.index.table
+
+    def insert(self, notes, display=False):
+        """
+        插入一批音符，参数同 NoteIndex.add。
+        :return: 新音符的行号数组（整理编辑记录时行号可能改变，只在下一次编辑前有效）
+        """
+        start = len(self.table)
+        self.index.add(notes, display)
+        rows = np.arange(start, len(self.table))
+        self._emit('append', rows)
+        self._record(('insert', rows, None, None))
+        return self.undo_stack[-1][1]
+
+    def delete(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        self.table.delete(rows.tolist())
+        self.index.remove(rows)
+        self._emit('delete', rows)
+        self._record(('delete', rows, None, None))
+
+    def move(self, rows, **values):
+        """
+        修改若干行的节拍或 x，例如 move(rows, x=[...], measure=[...], num=[...], den=[...])。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        names = [name for name in self.MOVE_COLUMNS if name in values]
+        before = {name: self.table.column(name)[rows].copy() for name in names}
+        after = {name: np.asarray(values[name], dtype=before[name].dtype) for name in names}
+        self._set(rows, after)
+        self._record(('move', rows, before, after))
+
+    def _set(self, rows, values):
+        for name, column in values.items():
+            self.table.column(name)[rows] = column
+        self.index.refresh(rows)
+        self._emit('set', rows, values)
+
+    def _emit(self, op, rows, values=None):
+        if not self.listeners:
+            return
+        record = {'op': op}
+        if op == 'append':
+            record['notes'] = [self.table.note(row) for row in rows.tolist()]
+        elif op == 'compact':
+            record['keep'] = rows.tolist()
+        else:
+            record['rows'] = rows.tolist()
+        if values is not None:
+            record['values'] = {name: column.tolist() for name, column in values.items()}
+        for listener in self.listeners:
+            listener(record)
+
+    def _apply(self, op, undo):
+        kind, rows, before, after = op
+        if kind == 'move':
+            self._set(rows, before if undo else after)
+        elif (kind == 'insert') == undo:
+            self.table.delete(rows.tolist())
+            self.index.remove(rows)
+            self._emit('delete', rows)
+        else:
+            self.table.restore(rows.tolist())
+            self.index.refresh(rows)
+            self._emit('restore', rows)
+
+    def _record(self, op):
+        self.undo_stack.append(op)
+        self.redo_stack.clear()
+        self.edits_since_checkpoint += 1
+        if self.edits_since_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def undo(self):
+        """
+        :return: 是否撤销了一步
+        """
+        if not self.undo_stack:
+            return False
+        op = self.undo_stack.pop()
+        self._apply(op, undo=True)
+        self.redo_stack.append(op)
+        return True
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+        op = self.redo_stack.pop()
+        self._apply(op, undo=False)
+        self.undo_stack.append(op)
+        return True
+
+    def checkpoint(self):
+        """
+        整理编辑记录：丢弃过旧的撤销步骤，已删除的行超过一半时压缩音符表。
+        """
+        self.edits_since_checkpoint = 0
+        del self.undo_stack[:-self.max_undo]
+        table = self.table
+        if table.deleted_count() * 2 <= len(table):
+            return None
+        # 仍可能被撤销/重做恢复的行需要保留
+        stacks = self.undo_stack + self.redo_stack
+        referenced = np.concatenate([op[1] for op in stacks]) if stacks else np.empty(0, dtype=np.int64)
+        mapping = np.array(table.compact(referenced.tolist()), dtype=np.int64)
+        self._emit('compact', referenced)
+        for stack in (self.undo_stack, self.redo_stack):
+            stack[:] = [(kind, mapping[rows], before, after) for kind, rows, before, after in stack]
+        self.index.rows = mapping[self.index.rows]
+        return mapping
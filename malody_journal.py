@@ -0,0 +1,191 @@
+"""
+编辑器的自动保存日志。
+
+每个谱面一个只追加的日志文件，每行一条紧凑 JSON 记录：
+    {"op": "base", ...}                      谱面来源信息，用于恢复时校验原谱面未变化
+    {"op": "snapshot", "notes": [...], "deleted": [...]}  音符表的完整内容（含已删除的行）
+    {"op": "append", "notes": [...]}         在表尾追加音符
+    {"op": "delete" / "restore", "rows": [...]}
+    {"op": "set", "rows": [...], "values": {"x": [...], ...}}
+行号与编辑器中的音符表一致。谱面导出后或正常退出时丢弃日志，下次打开时从原谱面开始。
+写入在后台线程进行：后台线程维护一份音符表的副本，
+按同样的顺序应用每条记录，因此可以随时独立地写出快照，压缩日志时不需要访问界面线程的数据。
+"""
+import os
+import queue
+import tempfile
+import threading
+
+import malody_json
+from malody_notes import DELETED, NoteTable
+
+COMPACT_ENTRIES = 500  # 距上次快照的记录数超过该值时压缩日志
+COMPACT_BYTES = 4 * 1024 * 1024  # 日志文件超过该大小时压缩
+
+
+def _apply(table, record):
+    """
+    把一条记录应用到音符表，返回（快照时为新的）音符表。
+    """
+    op = record['op']
+    if op == 'snapshot':
+        table = NoteTable(record['notes'])
+        table.delete(record['deleted'])
+    elif op == 'append':
+        table.extend(record['notes'])
+    elif op == 'delete':
+        table.delete(record['rows'])
+    elif op == 'restore':
+        table.restore(record['rows'])
+    elif op == 'set':
+        for name, values in record['values'].items():
+            column = getattr(table, name)
+            for row, value in zip(record['rows'], values):
+                column[row] = value
+    elif op == 'compact':
+        table.compact(record['keep'])
+    return table
+
+
+def read_base(path):
+    """
+    :return: 日志的来源信息（第一行），日志不存在或无法读取时为 None
+    """
+    try:
+        with open(path, 'rb') as f:
+            record = malody_json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    return record if isinstance(record, dict) and record.get('op') == 'base' else None
+
+
+def replay(path, table):
+    """
+    在原谱面的音符表上重放日志。写到一半的最后一行（例如程序崩溃时）会被忽略。
+    :return: (重放后的音符表, 应用的记录数)
+    """
+    count = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                record = malody_json.loads(line)
+            except ValueError:
+                break
+            if record.get('op') == 'base':
+                continue
+            table = _apply(table, record)
+            count += 1
+    return table, count
+
+
+def _snapshot(table):
+    notes = [table.note(row) for row in range(len(table))]
+    deleted = [row for row, flags in enumerate(table.flags) if flags & DELETED]
+    return {'op': 'snapshot', 'notes': notes, 'deleted': deleted}
+
+
+class Journal:
+    """
+    一个谱面的自动保存日志。record() 只把记录放进队列，不会阻塞调用者，
+    写入和压缩都在后台线程中进行。
+    """
+
+    def __init__(self, path, base, table, snapshot=False):
+        """
+        :param path: 日志文件路径
+        :param base: 来源信息（写在日志第一行）
+        :param table: 当前的音符表，后台线程保存其副本
+        :param snapshot: 为 True 时立即压缩为快照（例如恢复之后），否则重新开始日志
+        """
+        self.path = path
+        self.base = dict(base, op='base')
+        self.replica = table.copy()
+        self.queue = queue.Queue()
+        self.entries = 0  # 距上次快照的记录数
+        self.error = None  # 后台线程最近一次写入失败的异常
+        self.discarded = False  # 日志文件已被丢弃，下一条记录从快照重新开始
+        self.thread = threading.Thread(target=self._run, args=(snapshot,), name='autosave', daemon=True)
+        self.thread.start()
+
+    def record(self, record):
+        self.queue.put(record)
+
+    def discard(self):
+        """
+        丢弃日志文件（例如谱面已导出），下次打开谱面时不再重放之前的编辑。
+        之后再有编辑时，日志从当前音符表的快照重新开始。
+        """
+        self.queue.put({'op': 'discard'})
+
+    def close(self, discard=False):
+        """
+        写完队列中的记录后停止后台线程。
+        :param discard: 为 True 时随后删除日志文件（正常退出时）
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if discard and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _run(self, snapshot):
+        self._rewrite(snapshot)
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            # 一次取出队列中所有记录，合并为一次写入
+            records = [record]
+            while True:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write(records)
+                    return
+                records.append(record)
+            self._write(records)
+
+    def _write(self, records):
+        try:
+            written = []
+            for record in records:
+                if record['op'] == 'discard':
+                    written = []
+                    self.discarded = True
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    continue
+                self.replica = _apply(self.replica, record)
+                written.append(record)
+            if not written:
+                return
+            records = written
+            if self.discarded or any(record['op'] == 'compact' for record in records):
+                # 日志已被丢弃，或者行号已改变，之前的记录不能再按新行号重放
+                self.discarded = False
+                self._rewrite(True)
+                return
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(malody_json.dumps(record, compact=True) + b'\n' for record in records))
+            self.entries += len(records)
+            if self.entries >= COMPACT_ENTRIES or os.path.getsize(self.path) >= COMPACT_BYTES:
+                self._rewrite(True)
+        except Exception as e:
+            self.error = e
+
+    def _rewrite(self, snapshot):
+        """
+        原子地重写日志：来源信息，以及（snapshot 为 True 时）当前音符表的快照。
+        """
+        try:
+            lines = [self.base] + ([_snapshot(self.replica)] if snapshot else [])
+            directory = os.path.dirname(self.path)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(malody_json.dumps(line, compact=True) + b'\n' for line in lines))
+            os.replace(tmp_path, self.path)
+            self.entries = 0
+        except Exception as e:
+            self.error = e
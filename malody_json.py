@@ -0,0 +1,91 @@
+"""
+.mc 谱面的 JSON 读写层。
+
+优先使用已安装的 orjson / ujson，否则退回标准库 json。所有后端都保持键的顺序、
+原样输出非 ASCII 文本；compact 模式输出不带缩进和空格的最小化 JSON。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+elif ujson is not None:
+    BACKEND = 'ujson'
+else:
+    BACKEND = 'json'
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def loads(data):
+    """
+    解析 JSON 文本。
+    :param data: bytes 或 str，允许带 UTF-8 BOM
+    :return: 解析后的对象
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if data.startswith(UTF8_BOM):
+        data = data[len(UTF8_BOM):]
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # 例如 NaN/Infinity 等 orjson 不接受的写法，交给标准库
+    elif ujson is not None:
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data.decode('utf-8'))
+
+
+def dumps(obj, compact=False, indent=2):
+    """
+    序列化为 UTF-8 编码的 JSON。
+    :param obj: 要序列化的对象
+    :param compact: 为 True 时输出最小化 JSON
+    :param indent: 非 compact 模式下的缩进空格数
+    :return: bytes
+    """
+    if orjson is not None and (compact or indent == 2):
+        try:
+            return orjson.dumps(obj) if compact else orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            pass  # 超出 64 位的整数、非字符串键等，交给标准库
+    elif ujson is not None:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False,
+                               indent=0 if compact else indent).encode('utf-8')
+        except (TypeError, OverflowError):
+            pass
+    if compact:
+        text = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+    else:
+        text = json.dumps(obj, ensure_ascii=False, indent=indent)
+    return text.encode('utf-8')
+
+
+def load_file(path):
+    """
+    读取 JSON 文件。
+    """
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump_file(obj, path, compact=False, indent=2):
+    """
+    写入 JSON 文件。
+    """
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, compact, indent))
@@ -0,0 +1,200 @@
+"""
+谱面检查：在音符表的列上一次性运行一组规则，找出化简工具和编辑器会默默容忍的问题
+（例如分母为 0 的音符在编辑器里只是显示为灰色）。
+
+每条规则接收一个 ChartColumns，返回有问题的音符下标（即在谱面 note 列表中的位置）。
+批量检查时按文件分块交给进程池，同时在途的任务数有上限，结果按完成顺序逐个产出，
+内存占用与谱面库的大小无关。需要 NumPy。
+"""
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+import numpy as np
+
+import malody_json
+from malody_notes import HAS_BEAT, HAS_ENDBEAT, HAS_TYPE, HAS_X, NoteTable
+
+ERROR = 'error'
+WARNING = 'warning'
+X_RANGE = (0, 512)  # 接水果模式的 x 坐标范围（与编辑器的 X_TARGET_RANGE 一致）
+SOUND_TYPE = 1  # 音频音符的 type，不是可接的物件，不参与位置相关的检查
+MAX_ROWS = 20  # 每个问题最多列出多少个音符下标
+FILES_PER_TASK = 16  # 进程池中每个任务最多检查的文件数
+
+RULES = []  # (规则名, 严重程度, 检查函数)
+
+
+def rule(name, severity):
+    """
+    登记一条规则。
+    """
+    def register(func):
+        RULES.append((name, severity, func))
+        return func
+    return register
+
+
+def _normalize(measures, nums, dens):
+    """
+    把 beat 规范为 0 <= 分子 < 分母 的最简分数，分母不为正时位置为 NaN。
+    :return: (小节数, 分子, 分母, 绝对拍位置)
+    """
+    valid = dens > 0
+    safe_dens = np.where(valid, dens, 1)
+    carry, nums = np.divmod(nums, safe_dens)
+    measures = measures + carry
+    g = np.gcd(nums, safe_dens)
+    g[g == 0] = 1
+    nums, dens = nums // g, safe_dens // g
+    return measures, nums, dens, np.where(valid, measures + nums / dens, np.nan)
+
+
+class ChartColumns:
+    """
+    规则共用的列数据，每个谱面只计算一次。
+    """
+
+    def __init__(self, table):
+        flags = table.column('flags')
+        types = table.column('type')
+        self.count = len(table)
+        self.objects = ~((flags & HAS_TYPE != 0) & (types == SOUND_TYPE))  # 可接的物件
+
+        self.beat_rows = np.flatnonzero(flags & HAS_BEAT)
+        self.dens = table.column('den')[self.beat_rows].astype(np.int64)
+        self.measures, self.nums, self.norm_dens, self.positions = _normalize(
+            table.column('measure')[self.beat_rows].astype(np.int64),
+            table.column('num')[self.beat_rows].astype(np.int64), self.dens)
+
+        self.end_rows = np.flatnonzero(flags & HAS_ENDBEAT)
+        self.end_dens = table.column('end_den')[self.end_rows].astype(np.int64)
+        *_, self.end_positions = _normalize(table.column('end_measure')[self.end_rows].astype(np.int64),
+                                            table.column('end_num')[self.end_rows].astype(np.int64), self.end_dens)
+
+        self.has_x = flags & HAS_X != 0
+        self.xs = table.column('x')
+
+
+@rule('bad-denominator', ERROR)
+def bad_denominator(chart):
+    """beat 或 endbeat 的分母为 0 或负数（编辑器显示为灰色，化简工具原样保留）。"""
+    return np.union1d(chart.beat_rows[chart.dens <= 0], chart.end_rows[chart.end_dens <= 0])
+
+
+@rule('x-out-of-range', WARNING)
+def x_out_of_range(chart):
+    """x 超出 [0, 512]，编辑器导入时会把整个谱面的 x 重新缩放。"""
+    return np.flatnonzero(chart.has_x & ((chart.xs < X_RANGE[0]) | (chart.xs > X_RANGE[1])))
+
+
+@rule('overlapping-notes', WARNING)
+def overlapping_notes(chart):
+    """同一拍位置、同一 x 上有多个物件（每组中第一个之后的音符）。"""
+    keep = ~np.isnan(chart.positions) & chart.objects[chart.beat_rows]
+    rows = chart.beat_rows[keep]
+    if len(rows) < 2:
+        return rows[:0]
+    xs = np.where(chart.has_x[rows], chart.xs[rows], X_RANGE[0] - 1)
+    keys = (xs, chart.norm_dens[keep], chart.nums[keep], chart.measures[keep])
+    order = np.lexsort(keys)
+    same = np.ones(len(rows) - 1, dtype=bool)
+    for key in keys:
+        sorted_key = key[order]
+        same &= sorted_key[1:] == sorted_key[:-1]
+    return np.sort(rows[order[1:][same]])
+
+
+@rule('unsorted-beats', WARNING)
+def unsorted_beats(chart):
+    """物件不是按拍位置排列的（位置早于它前面的某个物件）。"""
+    keep = ~np.isnan(chart.positions) & chart.objects[chart.beat_rows]
+    positions = chart.positions[keep]
+    if len(positions) < 2:
+        return chart.beat_rows[:0]
+    earlier = positions[1:] < np.maximum.accumulate(positions)[:-1]
+    return chart.beat_rows[keep][1:][earlier]
+
+
+@rule('endbeat-before-beat', ERROR)
+def endbeat_before_beat(chart):
+    """长条的 endbeat 早于 beat。"""
+    rows, beat_at, end_at = np.intersect1d(chart.beat_rows, chart.end_rows, assume_unique=True, return_indices=True)
+    return rows[chart.end_positions[end_at] < chart.positions[beat_at]]
+
+
+def lint_chart(data, rules=None):
+    """
+    检查一个谱面。
+    :param data: .mc 谱面数据
+    :param rules: 只运行这些规则名，为空时运行全部规则
+    :return: {notes, issues}，issues 为 [{rule, severity, count, rows}]，rows 最多 MAX_ROWS 个
+    """
+    notes = data.get('note', []) if isinstance(data, dict) else []
+    chart = ChartColumns(NoteTable(notes))
+    issues = []
+    for name, severity, check in RULES:
+        if rules and name not in rules:
+            continue
+        rows = check(chart)
+        if len(rows):
+            issues.append({'rule': name, 'severity': severity, 'count': int(len(rows)),
+                           'rows': rows[:MAX_ROWS].tolist()})
+    return {'notes': chart.count, 'issues': issues}
+
+
+def lint_file(path, rules=None):
+    """
+    检查一个 .mc / .mcz 文件。压缩包中的谱面逐个直接从压缩包读取，不解压到磁盘。
+    :return: 检查结果列表，每个谱面一条 {path, chart, notes, issues}（chart 为压缩包成员名，.mc 为 None）；
+             无法读取时为 {path, chart, error}
+    """
+    results = []
+    try:
+        if not path.endswith('.mcz'):
+            with open(path, 'rb') as f:
+                data = f.read()
+            return [dict(path=path, chart=None, **lint_chart(malody_json.loads(data), rules))]
+        with zipfile.ZipFile(path, 'r') as zin:
+            for info in zin.infolist():
+                if not info.filename.endswith('.mc'):
+                    continue
+                try:
+                    result = lint_chart(malody_json.loads(zin.read(info)), rules)
+                except Exception as e:
+                    result = {'error': str(e)}
+                results.append(dict(path=path, chart=info.filename, **result))
+    except Exception as e:
+        results.append({'path': path, 'chart': None, 'error': str(e)})
+    return results
+
+
+def _lint_files(paths, rules):
+    return [result for path in paths for result in lint_file(path, rules)]
+
+
+def iter_lint(paths, workers=None, rules=None):
+    """
+    并行检查一批文件，按完成顺序逐个产出检查结果（见 lint_file）。
+    同时在途的任务不超过进程数的两倍，未取走的结果不会大量堆积。
+    :param workers: 进程数，默认为 CPU 核心数；为 1 时在当前进程内顺序检查
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            yield from lint_file(path, rules)
+        return
+
+    size = max(1, min(FILES_PER_TASK, len(paths) // (workers * 4)))
+    chunks = (paths[i:i + size] for i in range(0, len(paths), size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(_lint_files, chunk, rules))
+            if len(pending) < workers * 2:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+        for future in as_completed(pending):
+            yield from future.result()
@@ -0,0 +1,235 @@
+"""
+音符的列式存储。
+
+每个音符在 .mc 中是一个带嵌套 beat 列表的 dict，大谱面会产生大量小对象。NoteTable
+把常用字段存进平行的 array 列（安装了 NumPy 时可零拷贝地取得数组视图），
+其它字段和放不进列的值按行保存在 extras 中，并记录每行原始的键顺序，
+因此 to_notes() 可以无损地还原出原来的 dict。
+"""
+from array import array
+
+import malody_beats
+
+try:
+    import numpy as np
+except ImportError:  # 分度化简工具只依赖标准库
+    np = None
+
+INT_TYPECODE = 'i'  # 32 位有符号整数列
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+# flags 列的位：该字段的值存放在列中（而不是 extras 中）
+HAS_BEAT = 1
+HAS_ENDBEAT = 2
+HAS_X = 4
+HAS_TYPE = 8
+DELETED = 16  # 该行已被删除（编辑器撤销时可恢复），导出时跳过
+
+COLUMNS = ('measure', 'num', 'den', 'end_measure', 'end_num', 'end_den', 'x', 'type')
+
+
+def _is_int(value):
+    return type(value) is int and INT_MIN <= value <= INT_MAX
+
+
+def _is_beat(value):
+    # 逐项展开，避免为每个音符创建一个生成器
+    return type(value) is list and len(value) == 3 and _is_int(value[0]) and _is_int(value[1]) and _is_int(value[2])
+
+
+class NoteTable:
+    """
+    音符表。列：measure/num/den（beat）、end_measure/end_num/end_den（endbeat）、
+    x、type，以及 flags（哪些字段在列中）和 layout（该行键顺序在 layouts 中的下标）。
+    """
+
+    def __init__(self, notes=()):
+        for name in COLUMNS:
+            setattr(self, name, array(INT_TYPECODE))
+        self.flags = array('B')
+        self.layout = array('H')
+        self.layouts = []  # 出现过的键顺序，通常只有几种
+        self._layout_ids = {}
+        self.extras = {}  # 行号 -> 不在列中的字段
+        self.x_min = self.x_max = None  # x 列的取值范围，导入时顺带统计
+        self.extend(notes)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def extend(self, notes):
+        """
+        追加一批音符 dict。
+        """
+        row = len(self)
+        x_min, x_max = self.x_min, self.x_max
+        for note in notes:
+            flags = 0
+            extra = None
+            beat = note.get('beat')
+            if beat is not None and _is_beat(beat):
+                flags |= HAS_BEAT
+            endbeat = note.get('endbeat')
+            if endbeat is not None and _is_beat(endbeat):
+                flags |= HAS_ENDBEAT
+            x = note.get('x')
+            if x is not None and _is_int(x):
+                flags |= HAS_X
+                if x_min is None:
+                    x_min = x_max = x
+                elif x < x_min:
+                    x_min = x
+                elif x > x_max:
+                    x_max = x
+            note_type = note.get('type')
+            if note_type is not None and _is_int(note_type):
+                flags |= HAS_TYPE
+
+            beat = beat if flags & HAS_BEAT else (0, 0, 0)
+            endbeat = endbeat if flags & HAS_ENDBEAT else (0, 0, 0)
+            self.measure.append(beat[0])
+            self.num.append(beat[1])
+            self.den.append(beat[2])
+            self.end_measure.append(endbeat[0])
+            self.end_num.append(endbeat[1])
+            self.end_den.append(endbeat[2])
+            self.x.append(x if flags & HAS_X else 0)
+            self.type.append(note_type if flags & HAS_TYPE else 0)
+            self.flags.append(flags)
+
+            keys = tuple(note)
+            layout_id = self._layout_ids.get(keys)
+            if layout_id is None:
+                layout_id = self._layout_ids[keys] = len(self.layouts)
+                self.layouts.append(keys)
+            self.layout.append(layout_id)
+
+            # 其余字段（以及不能放进列中的值）原样保存
+            for key, value in note.items():
+                if key == 'beat' and flags & HAS_BEAT or key == 'endbeat' and flags & HAS_ENDBEAT \
+                        or key == 'x' and flags & HAS_X or key == 'type' and flags & HAS_TYPE:
+                    continue
+                if extra is None:
+                    extra = self.extras[row] = {}
+                extra[key] = value
+            row += 1
+        self.x_min, self.x_max = x_min, x_max
+
+    def copy(self):
+        """
+        复制音符表（列数据直接复制，extras 中的值与原表共享）。
+        """
+        table = NoteTable()
+        for name in COLUMNS + ('flags', 'layout'):
+            setattr(table, name, array(getattr(self, name).typecode, getattr(self, name)))
+        table.layouts = list(self.layouts)
+        table._layout_ids = dict(self._layout_ids)
+        table.extras = {row: dict(extra) for row, extra in self.extras.items()}
+        table.x_min, table.x_max = self.x_min, self.x_max
+        return table
+
+    def x_bounds(self):
+        """
+        :return: x 列的 (最小值, 最大值)，没有整数 x 时为 None
+        """
+        return None if self.x_min is None else (self.x_min, self.x_max)
+
+    def note(self, row):
+        """
+        还原第 row 个音符的 dict（键顺序与导入时一致）。
+        """
+        flags = self.flags[row]
+        extra = self.extras.get(row, {})
+        note = {}
+        for key in self.layouts[self.layout[row]]:
+            if key == 'beat' and flags & HAS_BEAT:
+                note[key] = [self.measure[row], self.num[row], self.den[row]]
+            elif key == 'endbeat' and flags & HAS_ENDBEAT:
+                note[key] = [self.end_measure[row], self.end_num[row], self.end_den[row]]
+            elif key == 'x' and flags & HAS_X:
+                note[key] = self.x[row]
+            elif key == 'type' and flags & HAS_TYPE:
+                note[key] = self.type[row]
+            else:
+                note[key] = extra[key]
+        return note
+
+    def to_notes(self):
+        """
+        还原为 .mc 中的音符 dict 列表（不含已删除的行）。
+        """
+        return list(self)
+
+    def __iter__(self):
+        return (self.note(row) for row, flags in enumerate(self.flags) if not flags & DELETED)
+
+    def delete(self, rows):
+        """
+        标记删除若干行。行号不变，可以用 restore() 恢复。
+        """
+        for row in rows:
+            self.flags[row] |= DELETED
+
+    def restore(self, rows):
+        for row in rows:
+            self.flags[row] &= ~DELETED
+
+    def deleted_count(self):
+        return sum(1 for flags in self.flags if flags & DELETED)
+
+    def compact(self, keep=()):
+        """
+        丢弃已删除的行（keep 中的行除外），之后的行号随之前移。
+        :return: 旧行号到新行号的映射列表，被丢弃的行为 -1
+        """
+        keep = set(keep)
+        kept = [row for row, flags in enumerate(self.flags) if not flags & DELETED or row in keep]
+        mapping = [-1] * len(self)
+        for new_row, row in enumerate(kept):
+            mapping[row] = new_row
+        for name in COLUMNS + ('flags', 'layout'):
+            col = getattr(self, name)
+            setattr(self, name, array(col.typecode, [col[row] for row in kept]))
+        self.extras = {mapping[row]: extra for row, extra in self.extras.items() if mapping[row] >= 0}
+        return mapping
+
+    def column(self, name):
+        """
+        返回列数据：NumPy 可用时为共享内存的 ndarray 视图（可写），否则为 array 本身。
+        视图存在期间不能再 extend，用完即弃。
+        """
+        col = getattr(self, name)
+        if np is None:
+            return col
+        return np.frombuffer(col, dtype=np.dtype(col.typecode)) if len(col) else np.empty(0, dtype=np.dtype(col.typecode))
+
+    def mask(self, flag):
+        """
+        返回某字段存放在列中的行的布尔掩码（NumPy 不可用时为列表）。
+        """
+        if np is None:
+            return [bool(f & flag) for f in self.flags]
+        return (self.column('flags') & flag) != 0
+
+    def simplify(self):
+        """
+        将所有 beat 化简为最简分数（原地修改）。
+        :return: 被改动的音符数
+        """
+        if np is None:
+            changed = 0
+            rows = [row for row, f in enumerate(self.flags) if f & HAS_BEAT]
+            new_nums, new_dens = malody_beats.simplify_beats([self.num[r] for r in rows], [self.den[r] for r in rows])
+            for row, n, d in zip(rows, new_nums, new_dens):
+                if n != self.num[row] or d != self.den[row]:
+                    self.num[row], self.den[row] = n, d
+                    changed += 1
+            return changed
+
+        rows = np.flatnonzero(self.mask(HAS_BEAT))
+        nums, dens = self.column('num'), self.column('den')
+        new_nums, new_dens = malody_beats.simplify_beats(nums[rows].astype(np.int64), dens[rows].astype(np.int64))
+        changed = (new_nums != nums[rows]) | (new_dens != dens[rows])
+        nums[rows] = new_nums
+        dens[rows] = new_dens
+        return int(changed.sum())
@@ -0,0 +1,163 @@
+"""
+可选的性能分析：按阶段统计耗时，并累计计数器（音符数、读写字节数、丢帧数等）。
+
+默认关闭，关闭时 stage()/count() 几乎没有开销。通过环境变量 MALODY_PROFILE
+或分度化简工具的 --profile 参数开启，取值决定输出位置：
+    1 或 -          结束时把统计结果以 JSON 写到标准错误
+    路径.json       把统计结果写入该文件
+    路径.prof       同时用 cProfile 分析整个运行，pstats 数据写入该文件，统计结果写到标准错误
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+
+ENV_VAR = 'MALODY_PROFILE'
+PSTATS_SUFFIXES = ('.prof', '.pstats')
+
+enabled = False
+target = None  # 输出位置
+stages = {}  # 阶段名 -> [次数, 总耗时（秒）, 最长耗时（秒）]
+counters = {}  # 计数器名 -> 累计值
+_profiler = None  # cProfile.Profile，输出 pstats 时使用
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """
+    统计一个阶段的耗时：with malody_profile.stage('json_parse'): ...
+    """
+    return _Stage(name) if enabled else _NULL_STAGE
+
+
+def add_time(name, seconds):
+    record = stages.get(name)
+    if record is None:
+        stages[name] = [1, seconds, seconds]
+    else:
+        record[0] += 1
+        record[1] += seconds
+        if seconds > record[2]:
+            record[2] = seconds
+
+
+def count(name, value=1):
+    """
+    累加计数器。
+    """
+    if enabled:
+        counters[name] = counters.get(name, 0) + value
+
+
+def snapshot(reset=False):
+    """
+    返回当前的统计数据（可被 JSON 序列化、可跨进程传递），reset 为 True 时随后清空。
+    """
+    data = {"stages": {name: list(record) for name, record in stages.items()}, "counters": dict(counters)}
+    if reset:
+        stages.clear()
+        counters.clear()
+    return data
+
+
+def merge(data):
+    """
+    合并其它进程的 snapshot()。
+    """
+    for name, (calls, total, longest) in data["stages"].items():
+        record = stages.setdefault(name, [0, 0.0, 0.0])
+        record[0] += calls
+        record[1] += total
+        record[2] = max(record[2], longest)
+    for name, value in data["counters"].items():
+        counters[name] = counters.get(name, 0) + value
+
+
+def report():
+    """
+    :return: 便于阅读的统计结果，阶段按总耗时降序排列
+    """
+    ordered = sorted(stages.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        "stages": {name: {"calls": calls, "total_ms": round(total * 1000, 3), "mean_ms": round(total * 1000 / calls, 3),
+                          "max_ms": round(longest * 1000, 3)}
+                   for name, (calls, total, longest) in ordered},
+        "counters": counters,
+    }
+
+
+def start(output='-'):
+    """
+    开启统计。output 见模块说明；以 .prof/.pstats 结尾时同时开启 cProfile。
+    进程结束时自动输出，也可以手动调用 finish()。
+    """
+    global enabled, target, _profiler
+    if enabled:
+        return
+    enabled = True
+    target = output
+    # 供多进程批处理中以 spawn 方式启动的子进程读取
+    os.environ[ENV_VAR] = output
+    if output.endswith(PSTATS_SUFFIXES):
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(finish)
+
+
+def start_from_env():
+    """
+    根据环境变量 MALODY_PROFILE 开启统计。
+    :return: 是否已开启
+    """
+    value = os.environ.get(ENV_VAR, '')
+    if value and value != '0':
+        start('-' if value == '1' else value)
+    return enabled
+
+
+def enable_in_worker():
+    """
+    在子进程中只开启统计（不输出），结果由 snapshot() 交回主进程合并。
+    """
+    global enabled
+    value = os.environ.get(ENV_VAR, '')
+    enabled = bool(value) and value != '0'
+    return enabled
+
+
+def finish():
+    """
+    停止统计并输出结果。
+    """
+    global enabled, _profiler
+    if not enabled:
+        return
+    enabled = False
+    text = json.dumps(report(), ensure_ascii=False, indent=2)
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(target)
+        _profiler = None
+    if target.endswith('.json'):
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text, file=sys.stderr)
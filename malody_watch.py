@@ -0,0 +1,174 @@
+"""
+监视目录中 .mc / .mcz 文件的新增和修改。
+
+Linux 上通过 ctypes 直接使用 inotify（递归监视子目录，不需要额外安装依赖），
+其它平台或 inotify 不可用时退回定时扫描目录。两种监视器都提供 poll(timeout)，
+返回这段时间内有变化（新建、写入、移入、删除）的谱面文件路径。
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+CHART_SUFFIXES = ('.mc', '.mcz')
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def is_chart(path):
+    return path.endswith(CHART_SUFFIXES)
+
+
+def scan_charts(directories):
+    """
+    递归扫描目录，返回 {谱面路径: (大小, 修改时间)}。
+    """
+    charts = {}
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if is_chart(file):
+                    path = os.path.join(root, file)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue  # 扫描期间被删除
+                    charts[path] = (st.st_size, st.st_mtime_ns)
+    return charts
+
+
+class PollingWatcher:
+    """
+    定时扫描目录，比较文件大小和修改时间。
+    """
+    mode = 'polling'
+
+    def __init__(self, directories, interval=2.0):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.interval = interval
+        self.charts = scan_charts(self.directories)
+        self.next_scan = time.monotonic() + interval
+
+    def poll(self, timeout=None):
+        now = time.monotonic()
+        wait = self.next_scan - now
+        if timeout is not None and timeout < wait:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait, 0))
+        self.next_scan = time.monotonic() + self.interval
+
+        charts = scan_charts(self.directories)
+        changed = [path for path, signature in charts.items() if self.charts.get(path) != signature]
+        changed += [path for path in self.charts if path not in charts]
+        self.charts = charts
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    基于 inotify 的监视器，新建的子目录会自动加入监视。
+    """
+    mode = 'inotify'
+
+    def __init__(self, directories):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # 监视描述符 -> 目录
+        try:
+            for directory in directories:
+                self._watch_tree(os.path.abspath(directory))
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {directory}")
+        self.watches[wd] = directory
+
+    def _watch_tree(self, directory):
+        """
+        监视目录及其所有子目录，返回其中已有的谱面文件。
+        """
+        charts = []
+        for root, _, files in os.walk(directory):
+            self._watch(root)
+            charts += [os.path.join(root, file) for file in files if is_chart(file)]
+        return charts
+
+    def poll(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，丢失的事件无法恢复，重新报告所有谱面
+                changed += list(scan_charts(set(self.watches.values())))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        changed += self._watch_tree(path)
+                    except OSError:
+                        pass  # 目录已被删除
+            elif is_chart(name):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(directories, poll_interval=2.0):
+    """
+    优先使用 inotify，不可用时（非 Linux、监视数量超过系统上限等）退回定时扫描。
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directories, poll_interval)